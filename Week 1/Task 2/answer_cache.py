@@ -0,0 +1,90 @@
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+# Case, spacing and trailing punctuation do not change the question
+def normalize_question(question):
+    return re.sub(r"\s+", " ", question).strip().rstrip("?!. ").lower()
+
+
+# On-disk answer cache keyed by document hash, model id, normalized question
+# and the request variant: a hash of the text actually sent to the model plus
+# how it was sent (single prompt or map-reduce), so an answer produced from a
+# few selected sections is never reused for a full-document request. Entries
+# expire after ttl seconds, the least recently used entries are evicted
+# beyond max_entries, and entries for any other version of the document are
+# dropped when the cache is opened.
+class AnswerCache:
+    def __init__(self, path, document_text, model_id, ttl, max_entries):
+        self.document_hash = content_hash(document_text)
+        self.model_id = model_id
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS answers (
+                key TEXT PRIMARY KEY,
+                document_hash TEXT NOT NULL,
+                model_id TEXT NOT NULL,
+                question TEXT NOT NULL,
+                result TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self.db.execute("CREATE INDEX IF NOT EXISTS answers_last_used ON answers (last_used)")
+        with self.db:
+            self.db.execute(
+                "DELETE FROM answers WHERE document_hash != ? OR created_at < ?",
+                (self.document_hash, time.time() - self.ttl)
+            )
+
+    @staticmethod
+    def variant(sent_text, mode):
+        return f"{mode}:{content_hash(sent_text)}"
+
+    def key(self, question, variant):
+        return content_hash("\n".join([
+            self.document_hash, self.model_id, normalize_question(question), variant
+        ]))
+
+    def get(self, question, variant):
+        key = self.key(question, variant)
+        now = time.time()
+        with self.lock, self.db:
+            row = self.db.execute(
+                "SELECT result, created_at FROM answers WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] < now - self.ttl:
+                self.db.execute("DELETE FROM answers WHERE key = ?", (key,))
+                return None
+            self.db.execute("UPDATE answers SET last_used = ? WHERE key = ?", (now, key))
+        result = json.loads(row[0])
+        result["cached_at"] = row[1]
+        return result
+
+    def put(self, question, variant, result):
+        now = time.time()
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (self.key(question, variant), self.document_hash, self.model_id, question,
+                 json.dumps(result, ensure_ascii=False), now, now)
+            )
+            self.db.execute("""
+                DELETE FROM answers WHERE key IN (
+                    SELECT key FROM answers ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                )
+            """, (self.max_entries,))
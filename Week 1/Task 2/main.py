@@ -1,57 +1,469 @@
+import argparse
 import boto3
 import json
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from answer_cache import AnswerCache
+from section_index import SectionIndex, estimate_tokens, split_shards
 
-# Read the large context document
-with open("large_context_doc.txt", "r", encoding="utf-8") as f:
-    document_content = f.read()
+# Prompt caching is only available on newer Claude models, so the document
+# prefix is sent to Claude 3.7 Sonnet through its cross-region inference profile
+MODEL_ID = "us.anthropic.claude-3-7-sonnet-20250219-v1:0"
+REGION = "us-east-1"
+MAX_TOKENS = 2000
 
-# Get user question
-input_text = input("Enter your question about the document: ")
+DOCUMENT_PATH = "large_context_doc.txt"
+OUTPUT_PATH = "bedrock_output.txt"
+BATCH_OUTPUT_PATH = "bedrock_output.jsonl"
 
-# Construct the prompt with document context
-prompt = f"""I'm providing you with enterprise cloud infrastructure documentation. Please read through it carefully and answer my question based on the information in the document.
+# Answer cache: repeat questions against the same document text, sent the same
+# way to the same model, are answered from disk instead of re-sending it
+ANSWER_CACHE_PATH = "answer_cache.sqlite3"
+ANSWER_CACHE_TTL_HOURS = 24 * 7
+ANSWER_CACHE_MAX_ENTRIES = 10000
 
-<document>
-{document_content}
-</document>
+# Batch mode: worker pool size and backoff for throttled calls
+DEFAULT_CONCURRENCY = 8
+MAX_CONCURRENCY = 32
+MAX_RETRIES = 6
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 30.0
+RETRYABLE_ERRORS = {
+    "ThrottlingException",
+    "TooManyRequestsException",
+    "ServiceUnavailableException",
+    "ModelNotReadyException",
+}
 
-Question: {input_text}
+# Section pre-selection (--select): token budget for the selected sections and
+# the BM25 relevance below which the full document is sent instead
+DEFAULT_SECTION_BUDGET = 2000
+DEFAULT_MIN_RELEVANCE = 0.15
 
-Please provide a detailed answer based solely on the information in the document above. If the information is not in the document, please say so."""
+# Map-reduce answering: used automatically when the text to send is larger
+# than the threshold (approximate tokens), with shards of SHARD_TOKENS each
+MAP_REDUCE_THRESHOLD = 150000
+SHARD_TOKENS = 50000
+MAP_MAX_TOKENS = 1000
+NO_INFO = "NO_RELEVANT_INFORMATION"
+
+# Read the large context document
+with open(DOCUMENT_PATH, "r", encoding="utf-8") as f:
+    document_content = f.read()
+
+# Document prefix sent as a system block. The full document gets a cache
+# checkpoint: it is identical for every question, so only the first question
+# of a session pays to process it.
+def document_prompt(document_text):
+    return f"""I'm providing you with enterprise cloud infrastructure documentation. Please read through it carefully and answer my question based on the information in the document.
+
+<document>
+{document_text}
+</document>"""
 
-# Initialize Bedrock client
+# Initialize Bedrock client. The connection pool is sized for the largest
+# batch pool; retries are handled by invoke_with_backoff instead of botocore.
 bedrock = boto3.client(
     service_name="bedrock-runtime",
-    region_name="us-east-1"
+    region_name=REGION,
+    config=Config(
+        max_pool_connections=MAX_CONCURRENCY,
+        retries={"mode": "standard", "max_attempts": 1}
+    )
 )
 
-print("\nQuerying Claude via AWS Bedrock...")
-
-# Invoke the model
-response = bedrock.invoke_model(
-    modelId="anthropic.claude-3-sonnet-20240229-v1:0",
-    contentType="application/json",
-    accept="application/json",
-    body=json.dumps({
-        "anthropic_version": "bedrock-2023-05-31",
-        "max_tokens": 2000,
-        "messages": [
-            {
-                "role": "user",
-                "content": prompt
-            }
-        ]
-    })
-)
 
-# Parse response
-result = json.loads(response["body"].read())
-output_text = result["content"][0]["text"]
+# Caps in-flight Bedrock calls across batch workers and map-reduce shards
+bedrock_slots = threading.BoundedSemaphore(DEFAULT_CONCURRENCY)
+
+
+# Retry throttled calls with capped exponential backoff and full jitter
+def invoke_with_backoff(stream=False, **kwargs):
+    operation = bedrock.invoke_model_with_response_stream if stream else bedrock.invoke_model
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            with bedrock_slots:
+                return operation(**kwargs)
+        except ClientError as e:
+            code = e.response.get("Error", {}).get("Code")
+            if code not in RETRYABLE_ERRORS or attempt == MAX_RETRIES:
+                raise
+            delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)
+            time.sleep(random.uniform(0, delay))
+
+
+# Read a response stream, passing each text delta to on_text as it arrives
+def read_stream(response, on_text):
+    parts = []
+    usage = {}
+    for event in response["body"]:
+        if "chunk" not in event:
+            continue
+        chunk = json.loads(event["chunk"]["bytes"])
+        if chunk["type"] == "message_start":
+            usage.update(chunk["message"].get("usage", {}))
+        elif chunk["type"] == "content_block_delta" and chunk["delta"].get("type") == "text_delta":
+            parts.append(chunk["delta"]["text"])
+            on_text(chunk["delta"]["text"])
+        elif chunk["type"] == "message_delta":
+            usage.update(chunk.get("usage", {}))
+    return "".join(parts), usage
+
+
+# One Claude call with a system prefix and a single user message. With
+# cache_prefix the prefix gets a cache checkpoint; only worth it for a prefix
+# that later calls repeat, since writing the cache costs more than plain input.
+# Passing on_text streams the answer instead of waiting for the full body.
+def invoke_claude(system_text, prompt, max_tokens=MAX_TOKENS, on_text=None, cache_prefix=False):
+    system_block = {"type": "text", "text": system_text}
+    if cache_prefix:
+        system_block["cache_control"] = {"type": "ephemeral"}
+    response = invoke_with_backoff(
+        stream=on_text is not None,
+        modelId=MODEL_ID,
+        contentType="application/json",
+        accept="application/json",
+        body=json.dumps({
+            "anthropic_version": "bedrock-2023-05-31",
+            "max_tokens": max_tokens,
+            "system": [system_block],
+            "messages": [
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ]
+        })
+    )
+
+    if on_text is not None:
+        return read_stream(response, on_text)
+
+    # Parse response
+    result = json.loads(response["body"].read())
+    return result["content"][0]["text"], result.get("usage", {})
+
+
+def ask(question, document_text=document_content, on_text=None):
+    # Construct the request: document prefix + per-question message. Only the
+    # full document is the same for every question, so only it is cached;
+    # selected sections differ from question to question.
+    prompt = f"""Question: {question}
+
+Please provide a detailed answer based solely on the information in the document above. If the information is not in the document, please say so."""
+
+    return invoke_claude(document_prompt(document_text), prompt, on_text=on_text,
+                         cache_prefix=document_text == document_content)
+
+
+def add_usage(total, usage):
+    total.update({k: v for k, v in usage.items() if isinstance(v, int)})
+    return total
+
+
+# Map step: pull out what one shard says about the question
+def map_shard(question, shard, number, count):
+    system_text = f"""You are reading part {number} of {count} of a large enterprise cloud infrastructure document.
+
+<document_part>
+{shard}
+</document_part>"""
+
+    prompt = f"""Question: {question}
+
+Extract every fact, rule, value and example from this part of the document that helps answer the question, quoting specifics exactly. Do not answer from outside knowledge. If this part contains nothing relevant, reply with exactly {NO_INFO}."""
+
+    return invoke_claude(system_text, prompt, MAP_MAX_TOKENS)
+
+
+# Map-reduce answering for documents too large for a single prompt: every
+# shard is queried in parallel, then the extracted notes are merged into one
+# final answer by a reduce call
+def map_reduce(question, document_text, concurrency, on_text=None):
+    shards = split_shards(document_text, SHARD_TOKENS)
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(shards)))) as pool:
+        partials = list(pool.map(
+            lambda i: map_shard(question, shards[i], i + 1, len(shards)),
+            range(len(shards))
+        ))
+
+    usage = Counter()
+    notes = []
+    for i, (text, shard_usage) in enumerate(partials):
+        add_usage(usage, shard_usage)
+        if NO_INFO not in text:
+            notes.append(f"<notes part=\"{i + 1}\">\n{text.strip()}\n</notes>")
+
+    info = {
+        "mode": "map-reduce",
+        "shards": len(shards),
+        "relevant_shards": len(notes),
+        "map_output_tokens": usage["output_tokens"],
+    }
+    if not notes:
+        output_text = "The information is not in the document."
+        if on_text is not None:
+            on_text(output_text)
+        return output_text, dict(usage), info
+
+    system_text = """You are answering a question about a large enterprise cloud infrastructure document. The document was too large to read at once, so relevant notes were extracted from each part of it."""
+
+    prompt = f"""{chr(10).join(notes)}
+
+Question: {question}
+
+Using only the notes above, provide a detailed answer. Reconcile notes from different parts into one consistent answer. If the notes do not contain the information, please say so."""
+
+    output_text, reduce_usage = invoke_claude(system_text, prompt, on_text=on_text)
+    return output_text, dict(add_usage(usage, reduce_usage)), info
+
+
+# Answer one question: choose the document text, then send it in a single
+# prompt or through map-reduce when it is too large for one. With stream=True
+# the answer is streamed to on_text and time-to-first-token and output
+# tokens/second (measured after the first token) are recorded as well.
+# Answers found in the cache are returned immediately and marked as cached.
+def answer(question, selector=None, map_reduce_mode="auto", concurrency=DEFAULT_CONCURRENCY,
+           stream=False, on_text=None, cache=None):
+    start = time.perf_counter()
+    first_token_at = []
+
+    document_text, info = context_for(question, selector)
+    use_map_reduce = map_reduce_mode == "on" or (
+        map_reduce_mode == "auto" and estimate_tokens(document_text) > MAP_REDUCE_THRESHOLD
+    )
+
+    # Cached answers are only reused for the same text sent the same way. A hit
+    # costs no tokens; what the original answer cost is kept as original_usage.
+    variant = None
+    if cache is not None:
+        variant = cache.variant(document_text, f"map-reduce/{SHARD_TOKENS}" if use_map_reduce else "single")
+        cached = cache.get(question, variant)
+        if cached is not None:
+            if stream and on_text is not None:
+                on_text(cached["answer"])
+            cached["original_usage"] = cached.pop("usage")
+            cached["usage"] = {}
+            cached["cached"] = True
+            cached["latency_s"] = round(time.perf_counter() - start, 3)
+            return cached
+
+    def on_stream_text(text):
+        if not first_token_at:
+            first_token_at.append(time.perf_counter())
+        if on_text is not None:
+            on_text(text)
+
+    stream_callback = on_stream_text if stream else None
+    if use_map_reduce:
+        output_text, usage, mr_info = map_reduce(question, document_text, concurrency, stream_callback)
+        info = dict(info, **mr_info)
+    else:
+        output_text, usage = ask(question, document_text, stream_callback)
+
+    end = time.perf_counter()
+    result = {
+        "answer": output_text,
+        "usage": usage,
+        "context": info,
+        "cached": False,
+        "latency_s": round(end - start, 3),
+    }
+    if first_token_at:
+        streamed_tokens = usage.get("output_tokens", 0) - info.get("map_output_tokens", 0)
+        generation_s = end - first_token_at[0]
+        result["ttft_s"] = round(first_token_at[0] - start, 3)
+        result["output_tokens_per_s"] = round(streamed_tokens / generation_s, 1) if generation_s > 0 else None
+
+    if cache is not None:
+        cache.put(question, variant, {"answer": output_text, "usage": usage, "context": info})
+    return result
+
+
+def format_usage(usage):
+    return (
+        f"input={usage.get('input_tokens', 0)} "
+        f"cache_read={usage.get('cache_read_input_tokens', 0)} "
+        f"cache_write={usage.get('cache_creation_input_tokens', 0)} "
+        f"output={usage.get('output_tokens', 0)}"
+    )
+
+
+def format_context(info):
+    if info["mode"] == "map-reduce":
+        return f"map-reduce over {info['shards']} shards ({info['relevant_shards']} relevant)"
+    if info["mode"] == "sections":
+        return f"{len(info['sections'])} sections (~{info['tokens']} tokens, relevance {info['relevance']})"
+    reason = f", {info['reason']}" if "reason" in info else ""
+    return f"full document (~{estimate_tokens(document_content)} tokens{reason})"
+
+
+# Pick the document text to send for a question: the whole document, or only
+# the relevant sections when a selector is configured
+def context_for(question, selector):
+    if selector is None:
+        return document_content, {"mode": "full"}
+    return selector(question)
+
+
+def format_timing(result):
+    if result.get("cached"):
+        return f"latency={result['latency_s']}s (cached answer)"
+    timing = f"latency={result['latency_s']}s"
+    if "ttft_s" in result:
+        timing += f" ttft={result['ttft_s']}s output_tokens/s={result['output_tokens_per_s']}"
+    return timing
 
 
 # Save to file
-with open("bedrock_output.txt", "a", encoding="utf-8") as f:
-    f.write("="*80 + "\n")
-    f.write("Input:\n" + input_text + "\n\n")
-    f.write("Output:\n" + output_text + "\n\n")
-print("\nResponse saved to bedrock_output.txt")
\ No newline at end of file
+def save_output(question, result):
+    with open(OUTPUT_PATH, "a", encoding="utf-8") as f:
+        f.write("="*80 + "\n")
+        f.write("Input:\n" + question + "\n\n")
+        f.write("Output:\n" + result["answer"] + "\n\n")
+        f.write("Context: " + format_context(result["context"]) + "\n")
+        f.write("Tokens: " + format_usage(result["usage"]) + "\n")
+        f.write("Timing: " + format_timing(result) + "\n\n")
+
+
+# Question session: the document prefix stays cached between questions
+def session(options):
+    while True:
+        input_text = input("\nEnter your question about the document (or 'exit'): ")
+        if input_text.lower() == "exit":
+            break
+        if not input_text.strip():
+            continue
+
+        print("\nQuerying Claude via AWS Bedrock...\n")
+        result = answer(
+            input_text,
+            on_text=lambda text: print(text, end="", flush=True),
+            **options
+        )
+
+        if not options["stream"]:
+            print(result["answer"], end="")
+        print("\n\nContext:", format_context(result["context"]))
+        print("Tokens:", format_usage(result["usage"]))
+        print("Timing:", format_timing(result))
+
+        save_output(input_text, result)
+        print("Response saved to " + OUTPUT_PATH)
+
+
+def load_questions(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [
+            line.strip() for line in f
+            if line.strip() and not line.lstrip().startswith("#")
+        ]
+
+
+def answer_record(index, question, options):
+    start = time.perf_counter()
+    record = {"index": index, "question": question}
+    try:
+        record.update(answer(question, **options))
+    except Exception as e:
+        record["error"] = str(e)
+        record["latency_s"] = round(time.perf_counter() - start, 3)
+    return record
+
+
+# Batch mode: answer a file of questions through a bounded worker pool and
+# stream one JSON line per answer as soon as it completes
+def run_batch(questions_path, output_path, options):
+    questions = load_questions(questions_path)
+    concurrency = options["concurrency"]
+    print(f"Answering {len(questions)} questions with {concurrency} workers...")
+
+    failed = 0
+    with open(output_path, "a", encoding="utf-8") as out:
+        def write(record):
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            print(f"[{record['index'] + 1}/{len(questions)}] "
+                  + ("ERROR " + record["error"] if "error" in record
+                     else format_timing(record) + " " + format_usage(record["usage"])))
+            return "error" in record
+
+        if not questions:
+            return
+
+        # The first answer writes the document to the prompt cache, so the
+        # rest of the batch is fanned out only after it has completed
+        failed += write(answer_record(0, questions[0], options))
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            futures = [
+                pool.submit(answer_record, i, q, options)
+                for i, q in enumerate(questions) if i > 0
+            ]
+            for future in as_completed(futures):
+                failed += write(future.result())
+
+    print(f"Done: {len(questions) - failed} answered, {failed} failed. "
+          f"Results saved to {output_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ask questions about the large context document")
+    parser.add_argument("--batch", metavar="QUESTIONS_FILE",
+                        help="answer every question in the file (one per line) instead of prompting")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help=f"parallel Bedrock calls for batch and map-reduce modes (max {MAX_CONCURRENCY})")
+    parser.add_argument("--output", default=BATCH_OUTPUT_PATH,
+                        help="JSONL file batch results are appended to")
+    parser.add_argument("--select", action="store_true",
+                        help="send only the document sections relevant to each question")
+    parser.add_argument("--budget", type=int, default=DEFAULT_SECTION_BUDGET,
+                        help="token budget for the selected sections")
+    parser.add_argument("--min-relevance", type=float, default=DEFAULT_MIN_RELEVANCE,
+                        help="send the full document when the best section scores below this (0-1)")
+    parser.add_argument("--map-reduce", choices=["auto", "on", "off"], default="auto",
+                        help=f"answer shard by shard (auto: above ~{MAP_REDUCE_THRESHOLD} tokens)")
+    parser.add_argument("--shard-tokens", type=int, default=SHARD_TOKENS,
+                        help="approximate tokens per map-reduce shard")
+    parser.add_argument("--stream", action="store_true",
+                        help="stream answers as they are generated and record time-to-first-token")
+    parser.add_argument("--no-cache", action="store_true",
+                        help=f"always call the model instead of reusing answers from {ANSWER_CACHE_PATH}")
+    parser.add_argument("--cache-ttl-hours", type=float, default=ANSWER_CACHE_TTL_HOURS,
+                        help="how long cached answers stay valid")
+    parser.add_argument("--cache-max-entries", type=int, default=ANSWER_CACHE_MAX_ENTRIES,
+                        help="least recently used answers beyond this are evicted")
+    args = parser.parse_args()
+
+    SHARD_TOKENS = args.shard_tokens
+    concurrency = max(1, min(args.concurrency, MAX_CONCURRENCY))
+    bedrock_slots = threading.BoundedSemaphore(concurrency)
+
+    selector = None
+    if args.select:
+        index = SectionIndex(document_content)
+        print(f"Indexed {len(index.sections)} sections of {DOCUMENT_PATH}")
+        selector = lambda q: index.select(q, args.budget, args.min_relevance)
+
+    options = {
+        "selector": selector,
+        "map_reduce_mode": args.map_reduce,
+        "concurrency": concurrency,
+        "stream": args.stream,
+        "cache": None if args.no_cache else AnswerCache(
+            ANSWER_CACHE_PATH,
+            document_content,
+            MODEL_ID,
+            ttl=args.cache_ttl_hours * 3600,
+            max_entries=args.cache_max_entries
+        ),
+    }
+    if args.batch:
+        run_batch(args.batch, args.output, options)
+    else:
+        session(options)
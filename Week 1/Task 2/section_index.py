@@ -0,0 +1,164 @@
+import math
+import re
+from collections import Counter
+
+# Markdown headings split the document into sections
+HEADING_PATTERN = re.compile(r"^(#{1,6})\s+(.*)$")
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for",
+    "from", "how", "i", "if", "in", "is", "it", "of", "on", "or", "should",
+    "that", "the", "this", "to", "what", "when", "which", "with", "you", "your",
+}
+
+# BM25 parameters
+K1 = 1.5
+B = 0.75
+
+# Sections scoring below this fraction of the best section are not worth sending
+RELATIVE_CUTOFF = 0.25
+
+
+# Rough local token count (~4 characters per token for English text)
+def estimate_tokens(text):
+    return len(text) // 4 + 1
+
+
+def tokenize(text):
+    return [t for t in TOKEN_PATTERN.findall(text.lower()) if t not in STOPWORDS]
+
+
+# Split on markdown headings. "body" is the section's own heading and text and
+# is what gets scored; "text" also carries the headings above it so a
+# "### 3.2 RDS Database Issues" section still says it belongs to the
+# troubleshooting guide when it is sent on its own.
+def split_sections(text):
+    sections = []
+    path = []
+    lines = []
+
+    def flush():
+        body = "\n".join(lines).strip()
+        if body.strip("-\n "):
+            parents = "\n".join(h for _, h in path[:-1])
+            sections.append({
+                "title": " > ".join(HEADING_PATTERN.match(h).group(2) for _, h in path),
+                "body": body,
+                "text": (parents + "\n" + body).strip() if parents else body,
+            })
+
+    for line in text.splitlines():
+        match = HEADING_PATTERN.match(line)
+        if match:
+            flush()
+            level = len(match.group(1))
+            path = [(lvl, h) for lvl, h in path if lvl < level] + [(level, line)]
+            lines = [line]
+        else:
+            lines.append(line)
+    flush()
+    return sections
+
+
+class SectionIndex:
+    def __init__(self, text):
+        self.text = text
+        self.sections = split_sections(text)
+        self.term_freqs = [Counter(tokenize(s["body"])) for s in self.sections]
+        self.lengths = [sum(tf.values()) for tf in self.term_freqs]
+        self.avg_length = sum(self.lengths) / max(len(self.lengths), 1)
+
+        doc_freq = Counter()
+        for tf in self.term_freqs:
+            doc_freq.update(tf.keys())
+        n = len(self.sections)
+        self.idf = {
+            term: math.log(1 + (n - df + 0.5) / (df + 0.5))
+            for term, df in doc_freq.items()
+        }
+
+    def score(self, query):
+        terms = [t for t in set(tokenize(query)) if t in self.idf]
+        scores = []
+        for tf, length in zip(self.term_freqs, self.lengths):
+            norm = K1 * (1 - B + B * length / self.avg_length)
+            scores.append(sum(
+                self.idf[t] * tf[t] * (K1 + 1) / (tf[t] + norm)
+                for t in terms if t in tf
+            ))
+        # Best score as a fraction of the BM25 upper bound for these terms
+        ceiling = sum(self.idf[t] * (K1 + 1) for t in terms)
+        relevance = max(scores, default=0) / ceiling if ceiling else 0.0
+        return scores, relevance
+
+    # Pick the highest scoring sections that fit in the token budget and return
+    # them in document order. Falls back to the full document when nothing
+    # scores well enough to trust the selection.
+    def select(self, query, budget, min_relevance):
+        scores, relevance = self.score(query)
+        info = {"relevance": round(relevance, 3)}
+
+        if relevance < min_relevance:
+            return self.text, dict(info, mode="full", reason="low relevance")
+
+        chosen = []
+        used = 0
+        floor = max(scores) * RELATIVE_CUTOFF
+        for i in sorted(range(len(scores)), key=lambda i: -scores[i]):
+            if scores[i] <= 0 or scores[i] < floor:
+                break
+            cost = estimate_tokens(self.sections[i]["text"])
+            if used + cost <= budget:
+                chosen.append(i)
+                used += cost
+
+        if not chosen:
+            return self.text, dict(info, mode="full", reason="no section fits budget")
+
+        chosen.sort()
+        return "\n\n".join(self.sections[i]["text"] for i in chosen), dict(
+            info,
+            mode="sections",
+            sections=[self.sections[i]["title"] for i in chosen],
+            tokens=used,
+        )
+
+
+# Split text into pieces of at most max_tokens, on paragraph boundaries where
+# possible and hard character cuts for anything longer than that
+def _split_oversized(text, max_tokens):
+    max_chars = max_tokens * 4
+    pieces = []
+    current = ""
+    for paragraph in text.split("\n\n"):
+        while len(paragraph) > max_chars:
+            pieces.append(paragraph[:max_chars])
+            paragraph = paragraph[max_chars:]
+        if current and estimate_tokens(current + "\n\n" + paragraph) > max_tokens:
+            pieces.append(current)
+            current = paragraph
+        else:
+            current = current + "\n\n" + paragraph if current else paragraph
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+# Pack consecutive sections into shards of at most max_tokens for map-reduce
+# answering of documents that do not fit in one prompt
+def split_shards(text, max_tokens):
+    shards = []
+    current = []
+    used = 0
+    for section in split_sections(text) or [{"text": text}]:
+        for piece in _split_oversized(section["text"], max_tokens):
+            cost = estimate_tokens(piece)
+            if current and used + cost > max_tokens:
+                shards.append("\n\n".join(current))
+                current, used = [], 0
+            current.append(piece)
+            used += cost
+    if current:
+        shards.append("\n\n".join(current))
+    return shards
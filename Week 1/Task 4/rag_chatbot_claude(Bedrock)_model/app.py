@@ -1,83 +1,643 @@
 import os
+import re
 import json
-import uuid
+import argparse
+import time
+import random
+import queue
+import hashlib
+import threading
+import multiprocessing
 import boto3
 import chromadb
+import numpy as np
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from botocore.config import Config
+from botocore.exceptions import ClientError
 from pypdf import PdfReader
+from pdf_pages import extract_pages, page_count
+from embedding_cache import EmbeddingCache
+from bm25_index import BM25Index, reciprocal_rank_fusion
+from semantic_cache import SemanticCache
+from compact_store import CompactStore
+from chunking import chunk_stats, chunk_spans, estimate_tokens, fixed_window_spans, normalize_text
+from context_assembly import assemble_context
 
 
-CHUNK_SIZE = 500
-CHUNK_OVERLAP = 100
-TOP_K = 4
+# Chunks follow sentence and line boundaries; sizes are approximate tokens
+CHUNK_TOKENS = 200
+CHUNK_OVERLAP_TOKENS = 30
+
+# Hybrid retrieval: dense and BM25 candidates are fused with reciprocal rank
+# fusion, which recovers exact-match hits (field names, loan codes) that the
+# dense search misses, so fewer chunks need to be sent to the model
+CANDIDATES = 10
+RRF_K = 60
+
+# Adaptive top-k: of the best MAX_K fused hits, only those within MAX_DISTANCE
+# (cosine) of the question and at least RELATIVE_CUTOFF as similar as the best
+# hit are kept, and never fewer than MIN_K of those within MAX_DISTANCE. With
+# none within MAX_DISTANCE the question is answered without context.
+MIN_K = 1
+MAX_K = 8
+MAX_DISTANCE = 0.75
+RELATIVE_CUTOFF = 0.8
+
+# Retrieved chunks are merged with their neighbours, de-duplicated and trimmed
+# to this many (approximate) tokens before being sent to the model
+CONTEXT_TOKENS = 600
+
+# Print every prompt sent to the model (questions and retrieved context), for
+# local debugging only
+DEBUG_PROMPTS = os.environ.get("DEBUG_PROMPTS") == "1"
+
 EMBED_MODEL = "amazon.titan-embed-text-v1"
 LLM_MODEL = "anthropic.claude-3-sonnet-20240229-v1:0"
 
+# Deterministic offline stand-in for Titan (hashed words and word pairs), used
+# by the benchmark so it can run without Bedrock
+LOCAL_EMBED_MODEL = "local-hash"
+LOCAL_EMBED_DIM = 1536
+
 CHROMA_DIR = "chroma"
 COLLECTION = "rag_docs"
+PDF_DIR = "pdfs"
+
+# HNSW index of the Chroma collection (defaults are Chroma's). M and
+# construction_ef are fixed when the index is built, so changing them rebuilds
+# the collection on the next start; search_ef is applied to the existing one.
+# Higher values trade build time, memory and latency for recall.
+HNSW_M = 16
+HNSW_CONSTRUCTION_EF = 100
+HNSW_SEARCH_EF = 100
+
+# Vector backend: "chroma", or "compact" for quantized vectors in memory-mapped
+# files (several times smaller, no index to load at start-up). The compact
+# store keeps float32 copies on disk to rerank its top candidates exactly.
+VECTOR_BACKEND = os.environ.get("VECTOR_BACKEND", "chroma")
+COMPACT_DIR = "compact_store"
+COMPACT_DTYPE = "int8"
+COMPACT_RERANK = True
+
+# Per-PDF fingerprints of what is already in the collection. Kept inside the
+# store directory so deleting the store also forgets what was ingested.
+MANIFEST_FILE = "ingest_manifest.json"
+
+# BM25 keyword index over the same chunks, kept alongside the manifest
+BM25_FILE = "bm25.sqlite3"
+
+# Snapshots: ids, documents, metadata, embeddings and the manifest in one NPZ
+# file, so a new replica can load the store without calling Titan
+SNAPSHOT_PATH = "snapshot.npz"
+SNAPSHOT_VERSION = 1
 
-# Bedrock Clients
-bedrock = boto3.client("bedrock-runtime")
+# Titan vectors already computed, reused by ingestion and retrieval
+EMBED_CACHE_PATH = "embedding_cache.sqlite3"
+EMBED_CACHE_MAX_ENTRIES = 200000
 
-# ChromaDB
-chroma = chromadb.PersistentClient(path=CHROMA_DIR)
+# Semantic cache: reworded repeats of a past question reuse its context and
+# answer when their embeddings are at least this similar (cosine)
+SEMANTIC_CACHE_THRESHOLD = 0.95
+SEMANTIC_CACHE_MAX_ENTRIES = 1000
 
-collection = chroma.get_or_create_collection(
-    name=COLLECTION,
-    metadata={"hnsw:space": "cosine"}
+# Ingestion pipeline: PDF pages are extracted in a process pool, chunked page
+# by page, embedded by parallel Titan workers and written to Chroma in batches.
+# Bounded queues between the stages keep memory flat regardless of PDF size.
+EXTRACT_WORKERS = os.cpu_count() or 1
+# Extraction workers are started while the pipeline (and, under server.py, the
+# event loop) threads are running, so they are never forked from this process.
+# forkserver is the default on Linux from Python 3.14; elsewhere the platform
+# default (spawn) is used.
+EXTRACT_CONTEXT = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else None
 )
+PAGES_PER_TASK = 8
+EMBED_WORKERS = 8
+QUEUE_SIZE = 256
+ADD_BATCH_SIZE = 500
+
+# HTTP connections shared by the embedding workers and concurrent server requests
+MAX_POOL_CONNECTIONS = 32
+
+# Backoff for throttled Bedrock calls
+MAX_RETRIES = 6
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 30.0
+RETRYABLE_ERRORS = {
+    "ThrottlingException",
+    "TooManyRequestsException",
+    "ServiceUnavailableException",
+    "ModelNotReadyException",
+}
+
+# Bedrock Clients (one pooled client shared by all threads; retries are done by
+# invoke_with_backoff)
+bedrock = boto3.client(
+    "bedrock-runtime",
+    config=Config(
+        max_pool_connections=MAX_POOL_CONNECTIONS,
+        retries={"mode": "standard", "max_attempts": 1}
+    )
+)
+
+# Vector store: collection, keyword index and manifest in one directory. Nothing
+# is opened on import; the entry points open the store they work on.
+chroma = collection = bm25 = manifest_path = None
+vector_backend = VECTOR_BACKEND
+
+def default_store_dir(backend=VECTOR_BACKEND):
+    return COMPACT_DIR if backend == "compact" else CHROMA_DIR
+
+def open_store(directory, backend=VECTOR_BACKEND):
+    global chroma, collection, bm25, manifest_path, vector_backend
+    vector_backend = backend
+    if backend == "compact":
+        chroma = None
+        collection = CompactStore(directory, COMPACT_DTYPE, COMPACT_RERANK)
+    else:
+        chroma = chromadb.PersistentClient(path=directory)
+        collection = open_collection(os.path.join(directory, MANIFEST_FILE))
+    bm25 = BM25Index(os.path.join(directory, BM25_FILE))
+    manifest_path = os.path.join(directory, MANIFEST_FILE)
+
+def hnsw_config():
+    return {
+        "space": "cosine",
+        "max_neighbors": HNSW_M,
+        "ef_construction": HNSW_CONSTRUCTION_EF,
+        "ef_search": HNSW_SEARCH_EF,
+    }
+
+def open_collection(manifest_file):
+    collection = chroma.get_or_create_collection(name=COLLECTION, configuration={"hnsw": hnsw_config()})
+    built = collection.configuration.get("hnsw") or {}
+    if (built.get("max_neighbors", HNSW_M), built.get("ef_construction", HNSW_CONSTRUCTION_EF)) \
+            != (HNSW_M, HNSW_CONSTRUCTION_EF):
+        # Dropping the manifest makes the next ingest re-add every PDF
+        print(f"HNSW settings changed (M={HNSW_M}, construction_ef={HNSW_CONSTRUCTION_EF}); rebuilding collection")
+        chroma.delete_collection(COLLECTION)
+        collection = chroma.create_collection(name=COLLECTION, configuration={"hnsw": hnsw_config()})
+        if os.path.exists(manifest_file):
+            os.remove(manifest_file)
+    elif built.get("ef_search", HNSW_SEARCH_EF) != HNSW_SEARCH_EF:
+        collection.modify(configuration={"hnsw": {"ef_search": HNSW_SEARCH_EF}})
+    return collection
+
+# Embedding cache, opened by open_embed_cache(); Titan vectors are not cached
+# until then
+embed_model = EMBED_MODEL
+embed_cache = None
+
+def open_embed_cache(path=EMBED_CACHE_PATH):
+    global embed_cache
+    embed_cache = EmbeddingCache(path, EMBED_CACHE_MAX_ENTRIES)
+
+# Answer cache for similar questions
+answer_cache = SemanticCache(SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_MAX_ENTRIES)
 
 # Helpers
+def invoke_with_backoff(stream=False, **kwargs):
+    call = bedrock.invoke_model_with_response_stream if stream else bedrock.invoke_model
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            return call(**kwargs)
+        except ClientError as e:
+            code = e.response.get("Error", {}).get("Code")
+            if code not in RETRYABLE_ERRORS or attempt == MAX_RETRIES:
+                raise
+            time.sleep(random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)))
+
+def local_embed(text):
+    vector = np.zeros(LOCAL_EMBED_DIM, dtype=np.float32)
+    words = re.findall(r"[a-z0-9]+", text.lower())
+    for feature in words + [a + " " + b for a, b in zip(words, words[1:])]:
+        digest = hashlib.md5(feature.encode("utf-8")).digest()
+        index = int.from_bytes(digest[:4], "little") % LOCAL_EMBED_DIM
+        vector[index] += 1.0 if digest[4] & 1 else -1.0
+    norm = np.linalg.norm(vector)
+    return (vector / norm if norm else vector).tolist()
+
+def use_local_embedder():
+    global embed_model
+    embed_model = LOCAL_EMBED_MODEL
+
 def embed(text: str):
-    response = bedrock.invoke_model(
+    if embed_model == LOCAL_EMBED_MODEL:
+        return local_embed(text)
+    cached = embed_cache.get(EMBED_MODEL, text) if embed_cache is not None else None
+    if cached is not None:
+        return cached
+    response = invoke_with_backoff(
         modelId=EMBED_MODEL,
         body=json.dumps({"inputText": text})
     )
-    return json.loads(response["body"].read())["embedding"]
+    embedding = json.loads(response["body"].read())["embedding"]
+    if embed_cache is not None:
+        embed_cache.put(EMBED_MODEL, text, embedding)
+    return embedding
 
-def chunk_text(text):
-    chunks = []
-    start = 0
-    while start < len(text):
-        chunks.append(text[start:start + CHUNK_SIZE])
-        start += CHUNK_SIZE - CHUNK_OVERLAP
-    return chunks
+def format_cache_stats():
+    if embed_cache is None:
+        return "Embedding cache: off"
+    stats = embed_cache.stats()
+    return f"Embedding cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0%} hit rate)"
 
-def load_pdf(path):
-    reader = PdfReader(path)
-    return "\n".join(
-        page.extract_text() or "" for page in reader.pages
-    )
+# (start, end, text) of each chunk, with offsets into the normalized page text
+def chunk_page(text):
+    text = normalize_text(text)
+    return [(start, end, text[start:end]) for start, end in chunk_spans(text, CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS)]
 
 # Ingestion
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+# Deterministic chunk id: re-ingesting the same content yields the same ids
+def chunk_id(source, page, index, chunk):
+    return hashlib.sha256(f"{source}\0{page}\0{index}\0{chunk}".encode("utf-8")).hexdigest()
+
+# Anything that changes the chunks or vectors of an unchanged PDF
+def ingest_settings():
+    settings = {
+        "chunking": "per-page-boundary",
+        "chunk_tokens": CHUNK_TOKENS,
+        "chunk_overlap_tokens": CHUNK_OVERLAP_TOKENS,
+        "chunk_metadata": ["source", "page", "start", "end"],
+        "embed_model": embed_model,
+    }
+    # The compact store is emptied when its layout changes
+    if vector_backend == "compact":
+        settings["compact_layout"] = collection.layout
+    return settings
+
+def load_manifest():
+    if not os.path.exists(manifest_path):
+        return {"settings": ingest_settings(), "files": {}}
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    # Different chunking or embedding settings invalidate every file
+    if manifest.get("settings") != ingest_settings():
+        return {"settings": ingest_settings(), "files": {}}
+    return manifest
+
+def save_manifest(manifest):
+    os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+# Returns the file's fingerprint, or None when the manifest says it is
+# unchanged. Size and mtime are checked first so unchanged files are not hashed.
+def changed_fingerprint(path, known):
+    stat = os.stat(path)
+    fingerprint = {"size": stat.st_size, "mtime": stat.st_mtime}
+    if known and known["size"] == stat.st_size and known["mtime"] == stat.st_mtime:
+        return None
+    fingerprint["sha256"] = file_sha256(path)
+    if known and known["sha256"] == fingerprint["sha256"]:
+        known["mtime"] = stat.st_mtime
+        return None
+    return fingerprint
+
+def max_batch_size():
+    return min(ADD_BATCH_SIZE, chroma.get_max_batch_size()) if chroma else ADD_BATCH_SIZE
+
+def add_in_batches(ids, documents, embeddings, metadatas):
+    batch_size = max_batch_size()
+    for i in range(0, len(ids), batch_size):
+        collection.add(
+            ids=ids[i:i + batch_size],
+            documents=documents[i:i + batch_size],
+            embeddings=embeddings[i:i + batch_size],
+            metadatas=metadatas[i:i + batch_size]
+        )
+    bm25.add(ids, documents, [m["source"] for m in metadatas])
+
+def delete_source(source):
+    collection.delete(where={"source": source})
+    bm25.delete_source(source)
+
+# Rebuild the keyword index from the collection if they have drifted apart,
+# e.g. for a store ingested before the index existed
+def sync_bm25():
+    total = collection.count()
+    if bm25.count() == total:
+        return
+    print(f"Rebuilding BM25 index for {total} chunks...")
+    bm25.clear()
+    batch_size = max_batch_size()
+    for offset in range(0, total, batch_size):
+        batch = collection.get(include=["documents", "metadatas"], limit=batch_size, offset=offset)
+        bm25.add(batch["ids"], batch["documents"], [m["source"] for m in batch["metadatas"]])
+
+# Marks the end of a stage's output
+STOP = object()
+
+# Staged ingestion of the given (file, fingerprint) pairs. Extraction futures,
+# chunks and embedded chunks flow through bounded queues; a file's manifest
+# entry is recorded once all of its chunks have been written.
+def run_pipeline(changed, manifest):
+    failed = threading.Event()
+    errors = []
+    extracted = queue.Queue(maxsize=EXTRACT_WORKERS * 2)
+    chunks = queue.Queue(maxsize=QUEUE_SIZE)
+    embedded = queue.Queue(maxsize=QUEUE_SIZE)
+
+    # Queue operations give up once any stage has failed, so a dead consumer
+    # cannot leave a producer blocked forever
+    def put(q, item):
+        while not failed.is_set():
+            try:
+                return q.put(item, timeout=0.5)
+            except queue.Full:
+                pass
+
+    def get(q):
+        while not failed.is_set():
+            try:
+                return q.get(timeout=0.5)
+            except queue.Empty:
+                pass
+        return STOP
+
+    def stage(target, *args):
+        def run():
+            try:
+                target(*args)
+            except Exception as e:
+                errors.append(e)
+                failed.set()
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    # Stage 1: submit page-range extraction tasks, in file order
+    def produce(processes):
+        for file, fingerprint in changed:
+            path = os.path.join(PDF_DIR, file)
+            # Drop whatever an earlier version of this file left behind
+            delete_source(file)
+            pages = page_count(path)
+            for start in range(0, pages, PAGES_PER_TASK):
+                stop = min(start + PAGES_PER_TASK, pages)
+                put(extracted, ("pages", file, processes.submit(extract_pages, path, start, stop)))
+            put(extracted, ("done", file, fingerprint))
+        put(extracted, STOP)
+
+    # Stage 2: chunk each page as soon as its extraction task finishes
+    def chunk():
+        counts = Counter()
+        while (item := get(extracted)) is not STOP:
+            kind, file, payload = item
+            if kind == "done":
+                put(chunks, {"file": file, "fingerprint": payload, "total": counts.pop(file, 0)})
+                continue
+            for page, text in payload.result():
+                for index, (start, end, piece) in enumerate(chunk_page(text)):
+                    put(chunks, {"file": file, "page": page, "index": index,
+                                 "start": start, "end": end, "text": piece})
+                    counts[file] += 1
+        for _ in range(EMBED_WORKERS):
+            put(chunks, STOP)
+
+    # Stage 3: embed chunks concurrently; file markers pass straight through
+    def embed_chunks():
+        while (item := get(chunks)) is not STOP:
+            if "text" in item:
+                item["embedding"] = embed(item["text"])
+            put(embedded, item)
+        put(embedded, STOP)
+
+    # Stage 4 (this thread): batch writes to Chroma and track finished files
+    pending = {"ids": [], "documents": [], "embeddings": [], "metadatas": []}
+    pending_files = {}
+    written = Counter()
+    expected = {}
+
+    # Manifest entries are only recorded once their chunks are in Chroma
+    def flush():
+        add_in_batches(**pending)
+        for values in pending.values():
+            values.clear()
+        manifest["files"].update(pending_files)
+        pending_files.clear()
+        save_manifest(manifest)
+
+    def check_done(file):
+        if file in expected and written[file] == expected[file]["total"]:
+            done = expected.pop(file)
+            pending_files[file] = dict(done["fingerprint"], chunks=done["total"])
+            print(f"Embedded: {file} ({done['total']} chunks)")
+
+    with ProcessPoolExecutor(max_workers=EXTRACT_WORKERS, mp_context=EXTRACT_CONTEXT) as processes:
+        threads = [stage(produce, processes), stage(chunk)]
+        threads += [stage(embed_chunks) for _ in range(EMBED_WORKERS)]
+
+        stopped = 0
+        try:
+            while stopped < EMBED_WORKERS and not failed.is_set():
+                item = get(embedded)
+                if item is STOP:
+                    stopped += 1
+                    continue
+                file = item["file"]
+                if "text" in item:
+                    pending["ids"].append(chunk_id(file, item["page"], item["index"], item["text"]))
+                    pending["documents"].append(item["text"])
+                    pending["embeddings"].append(item["embedding"])
+                    pending["metadatas"].append({
+                        "source": file, "page": item["page"], "start": item["start"], "end": item["end"]
+                    })
+                    written[file] += 1
+                else:
+                    expected[file] = item
+                check_done(file)
+                if len(pending["ids"]) >= ADD_BATCH_SIZE:
+                    flush()
+        except BaseException:
+            # Stops the other stages instead of leaving them blocked on full queues
+            failed.set()
+            raise
+        finally:
+            for thread in threads:
+                thread.join()
+
+    if errors:
+        raise errors[0]
+    flush()
+
+# Incremental, idempotent ingestion: unchanged PDFs are skipped, changed PDFs
+# have their old chunks replaced, and chunks of removed PDFs are deleted
 def ingest_pdfs():
-    for file in os.listdir('pdfs'):
-        if not file.endswith(".pdf"):
-            continue
+    manifest = load_manifest()
+    files = sorted(f for f in os.listdir(PDF_DIR) if f.endswith(".pdf"))
+
+    sync_bm25()
+    for removed in sorted(set(manifest["files"]) - set(files)):
+        delete_source(removed)
+        del manifest["files"][removed]
+        print(f"Removed: {removed}")
+
+    changed = []
+    for file in files:
+        fingerprint = changed_fingerprint(os.path.join(PDF_DIR, file), manifest["files"].get(file))
+        if fingerprint is not None:
+            changed.append((file, fingerprint))
+
+    if changed:
+        run_pipeline(changed, manifest)
+    save_manifest(manifest)
+
+    print(f"Skipped {len(files) - len(changed)} unchanged file(s); collection now holds {collection.count()} chunks")
+    print(format_cache_stats())
+
+# Snapshots. Text and metadata are stored as JSON bytes and vectors as one
+# float32 matrix, so loading never needs pickle.
+def export_snapshot(path):
+    total = collection.count()
+    ids, documents, metadatas, embeddings = [], [], [], []
+    for offset in range(0, total, max_batch_size()):
+        batch = collection.get(include=["documents", "metadatas", "embeddings"],
+                               limit=max_batch_size(), offset=offset)
+        ids += batch["ids"]
+        documents += batch["documents"]
+        metadatas += batch["metadatas"]
+        embeddings.append(np.asarray(batch["embeddings"], dtype=np.float32))
+
+    def as_bytes(value):
+        return np.frombuffer(json.dumps(value).encode("utf-8"), dtype=np.uint8)
+
+    tmp_path = path + ".tmp.npz"
+    np.savez_compressed(
+        tmp_path,
+        header=as_bytes({"version": SNAPSHOT_VERSION, "collection": COLLECTION, "count": len(ids)}),
+        ids=as_bytes(ids),
+        records=as_bytes({"documents": documents, "metadatas": metadatas}),
+        embeddings=np.vstack(embeddings) if embeddings else np.empty((0, 0), dtype=np.float32),
+        manifest=as_bytes(load_manifest()),
+    )
+    os.replace(tmp_path, path)
+    print(f"Exported {len(ids)} chunks to {path} ({os.path.getsize(path) / 1e6:.1f} MB)")
 
-        text = load_pdf(os.path.join('pdfs', file))
-        chunks = chunk_text(text)
+# Replaces the store's contents with the snapshot; the BM25 index is rebuilt
+# from it and the manifest restored, so the next ingest skips unchanged PDFs
+def import_snapshot(path):
+    global collection
+    with np.load(path, allow_pickle=False) as snapshot:
+        def from_bytes(name):
+            return json.loads(snapshot[name].tobytes().decode("utf-8"))
 
-        for chunk in chunks:
-            collection.add(
-                ids=[str(uuid.uuid4())],
-                documents=[chunk],
-                embeddings=[embed(chunk)],
-                metadatas=[{"source": file}]
-            )
+        header = from_bytes("header")
+        if header.get("version") != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported snapshot version {header.get('version')} (expected {SNAPSHOT_VERSION})")
+        # Snapshots move between backends, so only the chunking and embedding
+        # settings have to match
+        manifest = from_bytes("manifest")
+        settings = ingest_settings()
+        portable = {key: value for key, value in settings.items() if key != "compact_layout"}
+        if {key: value for key, value in manifest["settings"].items() if key != "compact_layout"} != portable:
+            raise ValueError("Snapshot was built with different chunking or embedding settings: "
+                             f"{manifest['settings']} != {settings}")
+        manifest["settings"] = settings
+        ids = from_bytes("ids")
+        records = from_bytes("records")
+        embeddings = snapshot["embeddings"]
 
-        print(f"Ingested: {file}")
+    if vector_backend == "compact":
+        collection.clear()
+    else:
+        chroma.delete_collection(COLLECTION)
+        collection = open_collection(manifest_path)
+    bm25.clear()
+    add_in_batches(ids, records["documents"], embeddings.tolist(), records["metadatas"])
+    save_manifest(manifest)
+    print(f"Imported {len(ids)} chunks from {path}; collection now holds {collection.count()} chunks")
 
 # Retrieval
-def retrieve(query):
+def cosine_distance(a, b):
+    a = np.asarray(a, dtype=np.float32)
+    b = np.asarray(b, dtype=np.float32)
+    norm = np.linalg.norm(a) * np.linalg.norm(b)
+    return float(1 - a @ b / norm) if norm else 1.0
+
+def retrieve_hits(query, query_embedding=None, k=MAX_K):
+    query_embedding = query_embedding or embed(query)
     results = collection.query(
-        query_embeddings=[embed(query)],
-        n_results=TOP_K
+        query_embeddings=[query_embedding],
+        n_results=CANDIDATES,
+        include=["documents", "metadatas", "distances"]
     )
-    return "\n".join(results["documents"][0])
+    hits = {
+        doc_id: {"id": doc_id, "text": text, "metadata": metadata, "distance": distance}
+        for doc_id, text, metadata, distance in zip(
+            results["ids"][0], results["documents"][0],
+            results["metadatas"][0], results["distances"][0]
+        )
+    }
+    keyword = bm25.search(query, CANDIDATES)
+
+    fused = reciprocal_rank_fusion(
+        [results["ids"][0], [doc_id for doc_id, _ in keyword]], RRF_K
+    )[:k]
+
+    # Keyword-only hits still need their text from Chroma, and their distance
+    # from the stored vector
+    missing = [doc_id for doc_id in fused if doc_id not in hits]
+    if missing:
+        extra = collection.get(ids=missing, include=["documents", "metadatas", "embeddings"])
+        for doc_id, text, metadata, embedding in zip(
+            extra["ids"], extra["documents"], extra["metadatas"], extra["embeddings"]
+        ):
+            hits[doc_id] = {"id": doc_id, "text": text, "metadata": metadata,
+                            "distance": cosine_distance(query_embedding, embedding)}
+    return [hits[doc_id] for doc_id in fused if doc_id in hits]
+
+# Adaptive top-k over fused hits (see MIN_K/MAX_K); keeps their fused order
+def select_hits(hits):
+    relevant = [hit for hit in hits[:MAX_K] if hit["distance"] <= MAX_DISTANCE]
+    if not relevant:
+        return []
+    floor = max(1 - hit["distance"] for hit in relevant) * RELATIVE_CUTOFF
+    return [hit for i, hit in enumerate(relevant) if i < MIN_K or 1 - hit["distance"] >= floor]
+
+# Returns the assembled context, or "" when nothing is relevant enough
+def retrieve(query, query_embedding=None):
+    hits = retrieve_hits(query, query_embedding)
+    kept = select_hits(hits)
+    context, tokens = assemble_context(kept, CONTEXT_TOKENS)
+    raw_tokens = sum(estimate_tokens(hit["text"]) for hit in kept)
+    distances = ", ".join(f"{hit['distance']:.3f}" for hit in hits)
+    print(f"Context: kept {len(kept)} of {len(hits)} chunks (distances {distances})")
+    if kept:
+        print(f"Context: ~{raw_tokens} tokens raw -> ~{tokens} tokens assembled")
+    else:
+        print("Context: nothing relevant, answering without documents")
+    return context
+
+# Changes whenever the collection does (in this or another process), so cached
+# answers are never served from an older version of the documents
+def collection_version():
+    mtime = os.stat(manifest_path).st_mtime_ns if os.path.exists(manifest_path) else None
+    return (mtime, collection.count())
 
 # Generation
-def generate(context, question):
-    prompt = f"""
+FALLBACK_PROMPT = """
+The documents do not cover this question.
+Start your answer with "Given context does not provide an answer. I will give you the answer based on my knowledge.", then answer the question.
+
+Question:
+{question}
+"""
+
+def build_prompt(context, question):
+    if not context:
+        return FALLBACK_PROMPT.format(question=question)
+    return f"""
 Answer ONLY using the context below.
 If the answer is not found, say "Given context does not provide an answer. I will give you the answer based on my knowledge.", then find the answer for the question.
 
@@ -87,8 +647,15 @@ Context:
 Question:
 {question}
 """
-    print (prompt)
-    response = bedrock.invoke_model(
+
+# With on_text the answer is streamed and each text delta is passed to it as it
+# arrives; the full answer is returned either way
+def generate(context, question, on_text=None):
+    prompt = build_prompt(context, question)
+    if DEBUG_PROMPTS:
+        print(prompt)
+    response = invoke_with_backoff(
+        stream=on_text is not None,
         modelId=LLM_MODEL,
         body=json.dumps({
             "anthropic_version": "bedrock-2023-05-31",
@@ -97,19 +664,94 @@ Question:
             "temperature": 0.2
         })
     )
+    if on_text is None:
+        return json.loads(response["body"].read())["content"][0]["text"]
+
+    parts = []
+    for event in response["body"]:
+        chunk = json.loads(event["chunk"]["bytes"])
+        if chunk["type"] == "content_block_delta" and chunk["delta"]["type"] == "text_delta":
+            parts.append(chunk["delta"]["text"])
+            on_text(chunk["delta"]["text"])
+    return "".join(parts)
 
-    return json.loads(response["body"].read())["content"][0]["text"]
+# Retrieve and generate, or reuse the answer to a sufficiently similar question
+def answer(question, on_text=None):
+    query_embedding = embed(question)
+    version = collection_version()
+    cached, similarity = answer_cache.lookup(query_embedding, version)
+    if cached is not None:
+        if on_text is not None:
+            on_text(cached["answer"])
+        return {"answer": cached["answer"], "context": cached["context"],
+                "cached": True, "similarity": round(similarity, 3)}
+
+    context = retrieve(question, query_embedding)
+    reply = generate(context, question, on_text)
+    answer_cache.store(query_embedding, question, context, reply, version)
+    return {"answer": reply, "context": context, "cached": False}
 
 # Chat
 def chat():
     while True:
         q = input("\nAsk (or 'exit'): ")
         if q.lower() == "exit":
+            print(format_cache_stats())
+            stats = answer_cache.stats()
+            print(f"Semantic cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0%} hit rate)")
             break
-        context = retrieve(q)
-        print("\nAnswer:\n", generate(context, q))
+        result = answer(q)
+        if result["cached"]:
+            print(f"\n(cached answer, similarity {result['similarity']})")
+        print("\nAnswer:\n", result["answer"])
+
+# Compare the boundary-aware chunker with the original 500/100 character windows
+def print_chunk_stats(path):
+    reader = PdfReader(path)
+    pages = [page.extract_text() or "" for page in reader.pages]
+
+    def boundary(page):
+        text = normalize_text(page)
+        return text, chunk_spans(text, CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS)
+
+    source_bytes, rows = chunk_stats(pages, {
+        "fixed 500/100 chars": lambda page: (page, fixed_window_spans(page)),
+        f"boundary {CHUNK_TOKENS}/{CHUNK_OVERLAP_TOKENS} tokens": boundary,
+    })
+    print(f"{os.path.basename(path)}: {len(pages)} pages, {source_bytes} bytes of text\n")
+    print(f"{'splitter':<26}{'chunks':>8}{'text':>10}{'bytes':>10}{'overhead':>10}{'avg tok':>9}{'max tok':>9}"
+          f"{'split words':>13}")
+    for row in rows:
+        print(f"{row['splitter']:<26}{row['chunks']:>8}{row['text_bytes']:>10}{row['chunk_bytes']:>10}"
+              f"{row['overhead']:>10.1%}{row['avg_tokens']:>9}{row['max_tokens']:>9}{row['split_words']:>13}")
 
 # Main
 if __name__ == "__main__":
-    # ingest_pdfs()
-    chat()
+    parser = argparse.ArgumentParser(description="Gold Loan RAG chatbot")
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("chat", help="ingest new or changed PDFs, then chat (default)")
+    commands.add_parser("ingest", help="ingest new or changed PDFs only")
+    export = commands.add_parser("export", help="write the store to a snapshot file")
+    export.add_argument("path", nargs="?", default=SNAPSHOT_PATH)
+    restore = commands.add_parser("import", help="replace the store with a snapshot (no embedding calls)")
+    restore.add_argument("path", nargs="?", default=SNAPSHOT_PATH)
+    stats = commands.add_parser("chunk-stats", help="compare chunkers on a PDF")
+    stats.add_argument("pdf", nargs="?", default=os.path.join(PDF_DIR, "Application Form - Gold Loan.pdf"))
+    args = parser.parse_args()
+
+    if args.command != "chunk-stats":
+        open_store(default_store_dir())
+        open_embed_cache()
+
+    if args.command == "chunk-stats":
+        print_chunk_stats(args.pdf)
+    elif args.command == "ingest":
+        ingest_pdfs()
+    elif args.command == "export":
+        export_snapshot(args.path)
+    elif args.command == "import":
+        import_snapshot(args.path)
+    else:
+        # Incremental: only new or changed PDFs are embedded
+        ingest_pdfs()
+        chat()
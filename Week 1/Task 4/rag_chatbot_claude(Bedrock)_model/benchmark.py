@@ -0,0 +1,165 @@
+import os
+import json
+import argparse
+import shutil
+import tempfile
+import time
+
+# The Bedrock client is created on import even when nothing calls it
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+import app
+
+GOLDEN_PATH = os.path.join("bench", "golden.jsonl")
+
+
+def load_golden(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def normalize(text):
+    return " ".join(text.lower().split())
+
+
+# Nearest-rank percentile of an already sorted list
+def percentile(values, p):
+    index = max(0, min(len(values) - 1, round(p / 100 * len(values) + 0.5) - 1))
+    return values[index]
+
+
+def dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+# A question is recalled at k when any expected passage appears in one of the
+# top k chunks
+def recalled(hits, expected, k):
+    texts = [normalize(hit["text"]) for hit in hits[:k]]
+    return any(normalize(passage) in text for passage in expected for text in texts)
+
+
+# Bytes a backend keeps in memory to search: Chroma loads its whole HNSW index
+# (vectors and graph), the compact store only maps its quantized vectors
+def resident_bytes(store, backend):
+    names = ("vectors.bin", "scales.bin") if backend == "compact" else ("data_level0.bin", "link_lists.bin")
+    total = 0
+    for root, _, files in os.walk(store):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files if name in names)
+    return total
+
+
+def run_benchmark(golden, ks, repeat):
+    depth = max(ks)
+    recall_hits = {k: 0 for k in ks}
+    adaptive_hits = 0
+    kept_total = 0
+    latencies = []
+    dense_ids = []
+    for item in golden:
+        hits = app.retrieve_hits(item["question"], k=depth)  # warm-up, also used for recall
+        for k in ks:
+            recall_hits[k] += recalled(hits, item["expected"], k)
+        kept = app.select_hits(hits)
+        kept_total += len(kept)
+        adaptive_hits += recalled(kept, item["expected"], len(kept))
+        for _ in range(repeat):
+            start = time.perf_counter()
+            app.retrieve_hits(item["question"], k=depth)
+            latencies.append((time.perf_counter() - start) * 1000)
+        dense = app.collection.query(query_embeddings=[app.embed(item["question"])], n_results=depth, include=[])
+        dense_ids.append(dense["ids"][0])
+
+    latencies.sort()
+    return {
+        "questions": len(golden),
+        "queries": len(latencies),
+        "chunks": app.collection.count(),
+        "latency_ms": {f"p{p}": round(percentile(latencies, p), 2) for p in (50, 95, 99)},
+        "recall": {f"@{k}": round(recall_hits[k] / len(golden), 3) for k in ks},
+        "adaptive": {"recall": round(adaptive_hits / len(golden), 3),
+                     "avg_kept": round(kept_total / len(golden), 2)},
+    }, dense_ids
+
+
+# Share of the reference backend's dense top k that another backend also returns
+def overlap(ids, reference_ids, k):
+    return round(sum(len(set(a[:k]) & set(b[:k])) / max(len(b[:k]), 1)
+                     for a, b in zip(ids, reference_ids)) / len(ids), 3)
+
+
+def benchmark_backend(backend, golden, ks, repeat, bedrock):
+    if bedrock:
+        store = app.default_store_dir(backend)
+        app.open_store(store, backend)
+        app.open_embed_cache()
+    else:
+        # Ingest the PDFs into a throwaway store with the deterministic embedder
+        store = tempfile.mkdtemp(prefix="rag_bench_")
+        app.use_local_embedder()
+        app.open_store(store, backend)
+        app.ingest_pdfs()
+
+    try:
+        report, dense_ids = run_benchmark(golden, ks, repeat)
+        report["backend"] = backend
+        report["embed_model"] = app.embed_model
+        report["index_bytes"] = dir_size(store)
+        report["resident_bytes"] = resident_bytes(store, backend)
+        report["settings"] = app.ingest_settings()
+    finally:
+        if not bedrock:
+            shutil.rmtree(store, ignore_errors=True)
+    return report, dense_ids
+
+
+def print_report(report):
+    print(f"\n== {report['backend']} ==")
+    print(f"Questions: {report['questions']} ({report['queries']} timed queries)")
+    print(f"Chunks:    {report['chunks']}")
+    print(f"Index:     {report['index_bytes'] / 1e6:.2f} MB on disk, {report['resident_bytes'] / 1e6:.2f} MB loaded to search")
+    print("Latency:   " + "  ".join(f"{p} {ms} ms" for p, ms in report["latency_ms"].items()))
+    print("Recall:    " + "  ".join(f"{k} {value}" for k, value in report["recall"].items()))
+    print(f"Adaptive:  recall {report['adaptive']['recall']} keeping {report['adaptive']['avg_kept']} chunks on average")
+    if "overlap" in report:
+        print(f"Dense top-k overlap with {report['overlap']['reference']}: "
+              + "  ".join(f"@{k} {value}" for k, value in report["overlap"]["at"].items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark retrieval latency and recall on a golden question set")
+    parser.add_argument("--golden", default=GOLDEN_PATH, help="JSONL file of {question, expected} records")
+    parser.add_argument("--k", type=int, nargs="+", default=[1, app.MAX_K, app.CANDIDATES], help="Report recall at these k")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per question")
+    parser.add_argument("--backend", nargs="+", choices=["chroma", "compact"], default=[app.VECTOR_BACKEND],
+                        help="Vector backends to run; later ones are compared with the first")
+    parser.add_argument("--bedrock", action="store_true",
+                        help="Query the existing stores with Titan embeddings instead of local offline ones")
+    parser.add_argument("--json", help="Also write the report to this file")
+    args = parser.parse_args()
+
+    golden = load_golden(args.golden)
+    ks = sorted(set(args.k))
+    reports = []
+    reference_ids = None
+    for backend in args.backend:
+        report, dense_ids = benchmark_backend(backend, golden, ks, args.repeat, args.bedrock)
+        if reference_ids is None:
+            reference_ids = dense_ids
+        else:
+            report["overlap"] = {"reference": args.backend[0],
+                                 "at": {k: overlap(dense_ids, reference_ids, k) for k in ks}}
+        print_report(report)
+        reports.append(report)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(reports, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+import math
+import re
+import sqlite3
+import threading
+from collections import Counter
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[./-][a-z0-9]+)*")
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "how", "in",
+    "is", "it", "of", "on", "or", "that", "the", "this", "to", "was", "what",
+    "which", "with",
+}
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+
+# Codes like "LAN", "ROI" or "12/2023" are kept whole so exact lookups match
+def tokenize(text):
+    return [t for t in TOKEN_PATTERN.findall(text.lower()) if t not in STOPWORDS]
+
+
+# Local inverted index for BM25 keyword search, stored in SQLite so it can be
+# updated incrementally alongside the Chroma collection
+class BM25Index:
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS docs (
+                id TEXT PRIMARY KEY,
+                source TEXT NOT NULL,
+                length INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS docs_source ON docs (source);
+            CREATE TABLE IF NOT EXISTS postings (
+                term TEXT NOT NULL,
+                id TEXT NOT NULL,
+                tf INTEGER NOT NULL,
+                PRIMARY KEY (term, id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS postings_id ON postings (id);
+        """)
+
+    def count(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+    def add(self, ids, documents, sources):
+        with self.lock, self.db:
+            for doc_id, text, source in zip(ids, documents, sources):
+                terms = Counter(tokenize(text))
+                self.db.execute("DELETE FROM postings WHERE id = ?", (doc_id,))
+                self.db.execute(
+                    "INSERT OR REPLACE INTO docs VALUES (?, ?, ?)",
+                    (doc_id, source, sum(terms.values()))
+                )
+                self.db.executemany(
+                    "INSERT INTO postings VALUES (?, ?, ?)",
+                    [(term, doc_id, tf) for term, tf in terms.items()]
+                )
+
+    def delete_source(self, source):
+        with self.lock, self.db:
+            self.db.execute(
+                "DELETE FROM postings WHERE id IN (SELECT id FROM docs WHERE source = ?)", (source,)
+            )
+            self.db.execute("DELETE FROM docs WHERE source = ?", (source,))
+
+    def clear(self):
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM postings")
+            self.db.execute("DELETE FROM docs")
+
+    # Top n (id, score) pairs for the query
+    def search(self, query, n):
+        terms = set(tokenize(query))
+        with self.lock:
+            total, avg_length = self.db.execute("SELECT COUNT(*), AVG(length) FROM docs").fetchone()
+            if not total or not terms:
+                return []
+            scores = Counter()
+            for term in terms:
+                rows = self.db.execute(
+                    "SELECT p.id, p.tf, d.length FROM postings p JOIN docs d ON d.id = p.id WHERE p.term = ?",
+                    (term,)
+                ).fetchall()
+                if not rows:
+                    continue
+                idf = math.log(1 + (total - len(rows) + 0.5) / (len(rows) + 0.5))
+                for doc_id, tf, length in rows:
+                    norm = K1 * (1 - B + B * length / avg_length)
+                    scores[doc_id] += idf * tf * (K1 + 1) / (tf + norm)
+        return scores.most_common(n)
+
+
+# Reciprocal rank fusion of several ranked id lists
+def reciprocal_rank_fusion(rankings, k=60):
+    scores = Counter()
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] += 1 / (k + rank + 1)
+    return [doc_id for doc_id, _ in scores.most_common()]
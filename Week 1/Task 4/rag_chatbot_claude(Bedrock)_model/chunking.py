@@ -0,0 +1,139 @@
+import re
+
+# Units are sentences or lines; a unit is a "strong" boundary when it ends a
+# sentence or a paragraph
+UNIT_BREAK = re.compile(r"(?<=[.!?])[ \t]+|\n")
+SENTENCE_END = re.compile(r"[.!?:;]\s*$")
+PARAGRAPH_BREAK = re.compile(r"\n[ \t]*\n")
+WORD_BREAK = re.compile(r"\s+")
+
+# Form blanks like "__________" and dot leaders add bytes but no meaning
+FILLER = re.compile(r"_{4,}|\.{4,}|[ \t]{2,}")
+
+
+# Rough local token count (~4 characters per token for English text)
+def estimate_tokens(text):
+    return len(text) // 4 + 1
+
+
+def _squash(match):
+    first = match.group()[0]
+    return "___" if first == "_" else "..." if first == "." else " "
+
+
+def normalize_text(text):
+    return FILLER.sub(_squash, text)
+
+
+# The original splitter: fixed character windows with a fixed overlap
+def fixed_window_spans(text, size=500, overlap=100):
+    return [(start, min(start + size, len(text))) for start in range(0, len(text), size - overlap)]
+
+
+# (start, end, strong, paragraph_end) for every sentence or line, with units
+# longer than max_tokens cut at word boundaries (or hard cut as a last resort)
+def _units(text, max_tokens):
+    paragraph_ends = {m.start() for m in PARAGRAPH_BREAK.finditer(text)}
+    units = []
+    pos = 0
+    for match in list(UNIT_BREAK.finditer(text)) + [None]:
+        end = match.start() if match else len(text)
+        if text[pos:end].strip():
+            units.extend(_fit(text, pos, end, max_tokens))
+            span = text[units[-1][0]:end]
+            units[-1] = (units[-1][0], end, bool(SENTENCE_END.search(span)) or end in paragraph_ends,
+                         end in paragraph_ends or match is None)
+        pos = match.end() if match else len(text)
+    return units
+
+
+def _fit(text, start, end, max_tokens):
+    if estimate_tokens(text[start:end]) <= max_tokens:
+        return [(start, end, False, False)]
+    max_chars = max_tokens * 4
+    pieces = []
+    piece_start = start
+    last_break = None
+    for match in WORD_BREAK.finditer(text, start, end):
+        if match.start() - piece_start > max_chars and last_break:
+            pieces.append((piece_start, last_break[0], False, False))
+            piece_start = last_break[1]
+        last_break = (match.start(), match.end())
+    while end - piece_start > max_chars:
+        pieces.append((piece_start, piece_start + max_chars, False, False))
+        piece_start += max_chars
+    pieces.append((piece_start, end, False, False))
+    return pieces
+
+
+# Boundary-aware chunking. Chunks are built from whole sentences/lines up to
+# max_tokens and end on a sentence or paragraph boundary when one is at least
+# half way into the chunk. Overlap is adaptive: the trailing sentences that fit
+# in overlap_tokens are repeated, and nothing is repeated across a paragraph
+# break. Returns (start, end) offsets into the normalized text.
+def chunk_spans(text, max_tokens=200, overlap_tokens=30):
+    units = _units(text, max_tokens)
+    spans = []
+    i = 0
+    while i < len(units):
+        start = units[i][0]
+        j = i + 1
+        while j < len(units) and estimate_tokens(text[start:units[j][1]]) <= max_tokens:
+            j += 1
+
+        # Prefer ending on a strong boundary if that keeps the chunk half full
+        if j < len(units) and not units[j - 1][2]:
+            for k in range(j - 1, i, -1):
+                if units[k - 1][2] and estimate_tokens(text[start:units[k - 1][1]]) >= max_tokens // 2:
+                    j = k
+                    break
+
+        spans.append((start, units[j - 1][1]))
+        if j >= len(units):
+            break
+
+        next_i = j
+        if not units[j - 1][3]:
+            while next_i - 1 > i and estimate_tokens(text[units[next_i - 1][0]:units[j - 1][1]]) <= overlap_tokens:
+                next_i -= 1
+        i = next_i
+    return spans
+
+
+def _splits_word(text, start, end):
+    return (start > 0 and text[start - 1].isalnum() and text[start].isalnum()) or \
+           (end < len(text) and text[end - 1].isalnum() and text[end].isalnum())
+
+
+# Compare splitters on the same pages. Each splitter maps a page to the text it
+# chunks and the (start, end) spans of its chunks. Overhead (the repeated
+# overlap) is measured against the text the splitter chunks, e.g. the
+# normalized text, not the raw page.
+def chunk_stats(pages, splitters):
+    source_bytes = sum(len(page.encode("utf-8")) for page in pages)
+    rows = []
+    for name, splitter in splitters.items():
+        chunks = 0
+        text_bytes = 0
+        chunk_bytes = 0
+        split_words = 0
+        tokens = []
+        for page in pages:
+            text, spans = splitter(page)
+            text_bytes += len(text.encode("utf-8"))
+            for start, end in spans:
+                chunks += 1
+                chunk_bytes += len(text[start:end].encode("utf-8"))
+                split_words += _splits_word(text, start, end)
+                tokens.append(estimate_tokens(text[start:end]))
+        rows.append({
+            "splitter": name,
+            "chunks": chunks,
+            "text_bytes": text_bytes,
+            "chunk_bytes": chunk_bytes,
+            "overhead": round(chunk_bytes / text_bytes - 1, 3) if text_bytes else 0.0,
+            "avg_tokens": round(sum(tokens) / len(tokens), 1) if tokens else 0,
+            "max_tokens": max(tokens, default=0),
+            "split_words": split_words,
+        })
+    return source_bytes, rows
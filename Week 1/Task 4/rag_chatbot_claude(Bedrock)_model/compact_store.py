@@ -0,0 +1,314 @@
+import os
+import json
+import sqlite3
+import threading
+
+import numpy as np
+
+# Rows scored per matrix product, so a search never materialises the whole
+# float32 matrix
+BLOCK_ROWS = 65536
+
+# With rerank, this many candidates per requested result are rescored against
+# the full-precision vectors
+RERANK_FACTOR = 4
+
+# The store is rewritten without deleted rows once they outnumber live ones
+COMPACT_MIN_DEAD = 1000
+
+DTYPES = {"int8": np.int8, "float16": np.float16}
+
+
+# Flat vector store with int8 or float16 vectors in memory-mapped files and
+# ids, documents and metadata in a SQLite side table. Vectors are normalized
+# on the way in, so search is a blocked dot product (cosine similarity) over
+# the quantized matrix. With rerank, float32 copies are kept on disk and only
+# the rows of the top candidates are read to re-score them exactly.
+#
+# It implements the part of the Chroma collection API the app uses (add,
+# delete, get, query, count) and returns results in the same shape, with
+# cosine distances.
+class CompactStore:
+    def __init__(self, directory, dtype="int8", rerank=True):
+        if dtype not in DTYPES:
+            raise ValueError(f"dtype must be one of {sorted(DTYPES)}")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.dtype = dtype
+        self.rerank = rerank
+        self.layout = f"{dtype}{'+f32' if rerank else ''}"
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.join(directory, "meta.sqlite3"), check_same_thread=False)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS settings (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS rows (
+                row INTEGER PRIMARY KEY,
+                id TEXT NOT NULL UNIQUE,
+                document TEXT NOT NULL,
+                metadata TEXT NOT NULL
+            );
+        """)
+
+        # A store written with other settings is emptied; the caller's
+        # manifest is expected to re-ingest everything in that case
+        settings = dict(self.db.execute("SELECT key, value FROM settings"))
+        if settings.get("layout") != self.layout:
+            self._clear()
+        self._load()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _clear(self):
+        with self.db:
+            self.db.execute("DELETE FROM rows")
+            self.db.execute("DELETE FROM settings")
+            self.db.execute("INSERT INTO settings VALUES ('layout', ?)", (self.layout,))
+        for name in ("vectors.bin", "scales.bin", "full.bin"):
+            if os.path.exists(self._path(name)):
+                os.remove(self._path(name))
+
+    # Maps the vector files and rebuilds the live-row mask from the side table.
+    # Only needed on open and after a rewrite; add and delete keep both up to
+    # date themselves.
+    def _load(self):
+        row = self.db.execute("SELECT value FROM settings WHERE key = 'dim'").fetchone()
+        self.dim = int(row[0]) if row else None
+        self.rows = self._complete_rows() if self.dim else 0
+        self._map()
+
+        self._alive = np.zeros(self.rows, dtype=bool)
+        live = np.fromiter((r for (r,) in self.db.execute("SELECT row FROM rows")), dtype=np.int64)
+        self._alive[live[live < self.rows]] = True
+        self.alive = self._alive[:self.rows]
+
+    # Bytes per row of each vector file in use
+    def _row_bytes(self):
+        files = {"vectors.bin": self.dim * np.dtype(DTYPES[self.dtype]).itemsize}
+        if self.dtype == "int8":
+            files["scales.bin"] = 4
+        if self.rerank:
+            files["full.bin"] = self.dim * 4
+        return files
+
+    # Rows present in every vector file. A crash during an append can leave
+    # the files with different lengths (or a partial row); the extra bytes
+    # belong to rows no metadata refers to yet, so they are cut off.
+    def _complete_rows(self):
+        files = self._row_bytes()
+        sizes = {name: os.path.getsize(self._path(name)) if os.path.exists(self._path(name)) else 0
+                 for name in files}
+        rows = min(sizes[name] // row_bytes for name, row_bytes in files.items())
+        for name, row_bytes in files.items():
+            if sizes[name] > rows * row_bytes:
+                os.truncate(self._path(name), rows * row_bytes)
+        return rows
+
+    # Maps the first self.rows rows of the vector files
+    def _map(self):
+        self.vectors = self.scales = self.full = None
+        if self.rows:
+            self.vectors = np.memmap(self._path("vectors.bin"), dtype=DTYPES[self.dtype], mode="r",
+                                     shape=(self.rows, self.dim))
+            if self.dtype == "int8":
+                self.scales = np.memmap(self._path("scales.bin"), dtype=np.float32, mode="r", shape=(self.rows,))
+            if self.rerank:
+                self.full = np.memmap(self._path("full.bin"), dtype=np.float32, mode="r",
+                                      shape=(self.rows, self.dim))
+
+    # Grows the live-row mask to self.rows; its buffer is over-allocated so
+    # that appending a batch does not copy the whole mask
+    def _grow_alive(self):
+        if self.rows > len(self._alive):
+            grown = np.zeros(max(self.rows, 2 * len(self._alive)), dtype=bool)
+            grown[:len(self._alive)] = self._alive
+            self._alive = grown
+        self.alive = self._alive[:self.rows]
+
+    def _rows_of(self, ids):
+        rows = []
+        for i in range(0, len(ids), 500):
+            batch = list(ids[i:i + 500])
+            rows += [r for (r,) in self.db.execute(
+                f"SELECT row FROM rows WHERE id IN ({','.join('?' * len(batch))})", batch
+            )]
+        return rows
+
+    def _quantize(self, unit):
+        if self.dtype == "float16":
+            return unit.astype(np.float16), None
+        scales = np.abs(unit).max(axis=1) / 127
+        scales[scales == 0] = 1.0
+        return np.round(unit / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+    @staticmethod
+    def _unit(embeddings):
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+    def _append(self, unit):
+        quantized, scales = self._quantize(unit)
+        with open(self._path("vectors.bin"), "ab") as f:
+            f.write(quantized.tobytes())
+        if scales is not None:
+            with open(self._path("scales.bin"), "ab") as f:
+                f.write(scales.tobytes())
+        if self.rerank:
+            with open(self._path("full.bin"), "ab") as f:
+                f.write(unit.tobytes())
+
+    def clear(self):
+        with self.lock:
+            self._clear()
+            self._load()
+
+    def count(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM rows").fetchone()[0]
+
+    # Existing ids are replaced
+    def add(self, ids, documents, embeddings, metadatas):
+        unit = self._unit(embeddings)
+        with self.lock:
+            if self.dim is None:
+                self.dim = unit.shape[1]
+                with self.db:
+                    self.db.execute("INSERT INTO settings VALUES ('dim', ?)", (str(self.dim),))
+            if unit.shape[1] != self.dim:
+                raise ValueError(f"Expected {self.dim}-dimensional embeddings, got {unit.shape[1]}")
+
+            # Vectors are written first: a crash in between leaves unreferenced
+            # (dead) rows rather than metadata pointing past the end of the
+            # files, and a partly written batch is cut off on the next open
+            self._append(unit)
+            replaced = self._rows_of(ids)
+            with self.db:
+                self.db.executemany("DELETE FROM rows WHERE id = ?", [(doc_id,) for doc_id in ids])
+                self.db.executemany(
+                    "INSERT INTO rows VALUES (?, ?, ?, ?)",
+                    [(self.rows + i, doc_id, text, json.dumps(metadata))
+                     for i, (doc_id, text, metadata) in enumerate(zip(ids, documents, metadatas))]
+                )
+            start = self.rows
+            self.rows += len(unit)
+            self._grow_alive()
+            self.alive[replaced] = False
+            self.alive[start:] = True
+            self._map()
+
+    # Deletes by ids and/or a single-key metadata match, e.g. {"source": name}
+    def delete(self, ids=None, where=None):
+        with self.lock:
+            deleted = self._rows_of(ids) if ids else []
+            with self.db:
+                if ids:
+                    self.db.executemany("DELETE FROM rows WHERE id = ?", [(doc_id,) for doc_id in ids])
+                for key, value in (where or {}).items():
+                    deleted += [r for (r,) in self.db.execute(
+                        "SELECT row FROM rows WHERE json_extract(metadata, ?) = ?", (f"$.{key}", value)
+                    )]
+                    self.db.execute("DELETE FROM rows WHERE json_extract(metadata, ?) = ?", (f"$.{key}", value))
+            self.alive[deleted] = False
+            dead = self.rows - int(self.alive.sum())
+            if dead >= COMPACT_MIN_DEAD and dead > self.rows - dead:
+                self._compact()
+
+    # Rewrites the vector files with live rows only and renumbers the side table
+    def _compact(self):
+        live = np.flatnonzero(self.alive)
+        unit = np.asarray(self.full[live]) if self.rerank else None
+        quantized = np.asarray(self.vectors[live])
+        scales = self.scales[live] if self.scales is not None else None
+        self.vectors = self.scales = self.full = None
+
+        for name, data in (("vectors.bin", quantized), ("scales.bin", scales), ("full.bin", unit)):
+            if data is not None:
+                data.tofile(self._path(name) + ".tmp")
+                os.replace(self._path(name) + ".tmp", self._path(name))
+        with self.db:
+            # Rows only move down, so renumbering in ascending order never collides
+            self.db.executemany("UPDATE rows SET row = ? WHERE row = ?",
+                                [(new, int(old)) for new, old in enumerate(live)])
+        self._load()
+
+    def _fetch(self, rows, include):
+        records = {}
+        for i in range(0, len(rows), 500):
+            batch = [int(r) for r in rows[i:i + 500]]
+            query = f"SELECT row, id, document, metadata FROM rows WHERE row IN ({','.join('?' * len(batch))})"
+            for row, doc_id, text, metadata in self.db.execute(query, batch):
+                records[row] = (doc_id, text, json.loads(metadata))
+        result = {"ids": [records[int(r)][0] for r in rows]}
+        if "documents" in include:
+            result["documents"] = [records[int(r)][1] for r in rows]
+        if "metadatas" in include:
+            result["metadatas"] = [records[int(r)][2] for r in rows]
+        if "embeddings" in include:
+            result["embeddings"] = self._vectors(np.asarray(rows, dtype=np.int64))
+        return result
+
+    # Stored vectors of the given rows: the float32 copies when kept, otherwise
+    # the dequantized ones (both unit length)
+    def _vectors(self, rows):
+        if not len(rows):
+            return np.empty((0, self.dim or 0), dtype=np.float32)
+        if self.rerank:
+            return np.asarray(self.full[rows])
+        vectors = np.asarray(self.vectors[rows], dtype=np.float32)
+        return vectors * self.scales[rows, None] if self.scales is not None else vectors
+
+    def get(self, ids=None, include=("documents", "metadatas"), limit=None, offset=0):
+        with self.lock:
+            if ids is not None:
+                found = dict(self.db.execute(
+                    f"SELECT id, row FROM rows WHERE id IN ({','.join('?' * len(ids))})", list(ids)
+                )) if ids else {}
+                rows = [found[doc_id] for doc_id in ids if doc_id in found]
+            else:
+                rows = [r for (r,) in self.db.execute(
+                    "SELECT row FROM rows ORDER BY row LIMIT ? OFFSET ?", (-1 if limit is None else limit, offset)
+                )]
+            return self._fetch(rows, include)
+
+    # Approximate cosine similarity of every row to the unit query
+    def _scores(self, query):
+        scores = np.empty(self.rows, dtype=np.float32)
+        for start in range(0, self.rows, BLOCK_ROWS):
+            block = np.asarray(self.vectors[start:start + BLOCK_ROWS], dtype=np.float32)
+            scores[start:start + BLOCK_ROWS] = block @ query
+        if self.scales is not None:
+            scores *= self.scales
+        scores[~self.alive] = -np.inf
+        return scores
+
+    def _search(self, query, n_results):
+        live = int(self.alive.sum())
+        n_results = min(n_results, live)
+        if not n_results:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        scores = self._scores(query)
+        n_candidates = min(live, n_results * RERANK_FACTOR) if self.rerank else n_results
+        candidates = np.argpartition(-scores, n_candidates - 1)[:n_candidates]
+        if self.rerank:
+            candidates.sort()
+            similarities = np.asarray(self.full[candidates]) @ query
+        else:
+            similarities = scores[candidates]
+        order = np.argsort(-similarities)[:n_results]
+        return candidates[order], similarities[order]
+
+    def query(self, query_embeddings, n_results=10, include=("documents", "metadatas", "distances")):
+        result = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        with self.lock:
+            for query in self._unit(query_embeddings):
+                rows, similarities = self._search(query, n_results)
+                found = self._fetch(rows, include)
+                for key, values in found.items():
+                    result[key].append(values)
+                result["distances"].append([float(1 - s) for s in similarities])
+        return {key: values for key, values in result.items() if key == "ids" or key in include}
@@ -0,0 +1,120 @@
+import heapq
+
+from chunking import UNIT_BREAK, WORD_BREAK, estimate_tokens
+
+# Chunks of the same page this close together (in characters) are merged
+MERGE_GAP = 2
+
+
+# Merge hits from the same page whose spans overlap or touch into one block,
+# dropping the repeated text. Each block keeps the best (lowest) rank of the
+# hits it was built from, and those hits as its "parts". Hits without offsets
+# stay as separate blocks.
+def merge_hits(hits):
+    blocks = []
+    by_page = {}
+    for rank, hit in enumerate(hits):
+        metadata = hit.get("metadata") or {}
+        block = {
+            "source": metadata.get("source"),
+            "page": metadata.get("page"),
+            "start": metadata.get("start"),
+            "end": metadata.get("end"),
+            "text": hit["text"],
+            "rank": rank,
+            "parts": [],
+        }
+        if block["start"] is None or block["end"] is None:
+            blocks.append(block)
+        else:
+            by_page.setdefault((block["source"], block["page"]), []).append(block)
+
+    for page_blocks in by_page.values():
+        page_blocks.sort(key=lambda b: b["start"])
+        current = dict(page_blocks[0], parts=[page_blocks[0]])
+        for block in page_blocks[1:]:
+            if block["start"] > current["end"] + MERGE_GAP:
+                blocks.append(current)
+                current = dict(block, parts=[block])
+                continue
+            current["parts"].append(block)
+            if block["end"] > current["end"]:
+                overlap = current["end"] - block["start"]
+                joiner = "\n" if overlap < 0 else ""
+                current["text"] += joiner + block["text"][max(overlap, 0):]
+                current["end"] = block["end"]
+            current["rank"] = min(current["rank"], block["rank"])
+        blocks.append(current)
+    return blocks
+
+
+def _position(block):
+    return (block["source"] or "", block["page"] or 0, block["start"] or 0)
+
+
+def _header(block):
+    label = block["source"] or "unknown source"
+    if block["page"] is not None:
+        label += f", page {block['page']}"
+    return f"[{label}]\n"
+
+
+# Header, text and the blank line between blocks
+def _cost(header, text):
+    return estimate_tokens(f"\n\n{header}{text}")
+
+
+# Longest prefix of text that ends on a sentence or line boundary and fits in
+# max_tokens. When not even the first sentence fits, it is cut at a word
+# boundary instead.
+def truncate_to_tokens(text, max_tokens):
+    cut = ""
+    for match in list(UNIT_BREAK.finditer(text)) + [None]:
+        end = match.start() if match else len(text)
+        if estimate_tokens(text[:end].rstrip()) > max_tokens:
+            break
+        cut = text[:end].rstrip()
+    if cut or max_tokens < 1:
+        return cut
+    max_chars = (max_tokens - 1) * 4 + 3
+    breaks = [m.start() for m in WORD_BREAK.finditer(text, 0, max_chars + 1)]
+    return text[:breaks[-1]].rstrip() if breaks else ""
+
+
+# Build the prompt context from ranked hits: merge neighbouring chunks, drop
+# duplicate text, keep the best blocks that fit in budget_tokens, and emit them
+# in document order with their source and page. A merged block that does not
+# fit is split back into its hits, which are ranked on their own, so the best
+# hit of a long run is never the part that gets cut; a single hit that
+# overflows is cut back to a sentence or line boundary.
+def assemble_context(hits, budget_tokens):
+    chosen = []
+    seen = set()
+    used = 0
+    queue = [(block["rank"], i, block) for i, block in enumerate(merge_hits(hits))]
+    heapq.heapify(queue)
+    count = len(queue)
+    while queue:
+        _, _, block = heapq.heappop(queue)
+        text = block["text"].strip()
+        key = " ".join(text.split())
+        if key in seen:
+            continue
+        header = _header(block)
+        cost = _cost(header, text)
+        if used + cost > budget_tokens and len(block["parts"]) > 1:
+            for part in block["parts"]:
+                heapq.heappush(queue, (part["rank"], count, part))
+                count += 1
+            continue
+        if used + cost > budget_tokens:
+            text = truncate_to_tokens(text, budget_tokens - used - _cost(header, ""))
+            if not text:
+                continue
+            cost = _cost(header, text)
+        seen.add(key)
+        chosen.append(dict(block, text=text, header=header))
+        used += cost
+
+    parts = [block["header"] + block["text"] for block in sorted(chosen, key=_position)]
+    return "\n\n".join(parts), used
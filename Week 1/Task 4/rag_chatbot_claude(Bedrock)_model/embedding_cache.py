@@ -0,0 +1,71 @@
+import hashlib
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+# Evicting scans the table, so it only runs every few writes
+TRIM_EVERY = 100
+
+
+# Disk-backed embedding cache keyed by a hash of the model id and the text.
+# Vectors are stored as float32 blobs, and the least recently used entries are
+# evicted once the cache holds more than max_entries.
+class EmbeddingCache:
+    def __init__(self, path, max_entries):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.puts_since_trim = 0
+
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key BLOB PRIMARY KEY,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self.db.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+
+    @staticmethod
+    def key(model_id, text):
+        return hashlib.sha256(f"{model_id}\0{text}".encode("utf-8")).digest()
+
+    def get(self, model_id, text):
+        key = self.key(model_id, text)
+        with self.lock, self.db:
+            row = self.db.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.db.execute("UPDATE embeddings SET last_used = ? WHERE key = ?", (time.time(), key))
+        return np.frombuffer(row[0], dtype=np.float32).tolist()
+
+    def put(self, model_id, text, vector):
+        blob = np.asarray(vector, dtype=np.float32).tobytes()
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)",
+                (self.key(model_id, text), blob, time.time())
+            )
+            self.puts_since_trim += 1
+            if self.puts_since_trim >= TRIM_EVERY:
+                self.puts_since_trim = 0
+                self.db.execute("""
+                    DELETE FROM embeddings WHERE key IN (
+                        SELECT key FROM embeddings ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                    )
+                """, (self.max_entries,))
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
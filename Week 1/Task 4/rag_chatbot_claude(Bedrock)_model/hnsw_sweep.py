@@ -0,0 +1,156 @@
+import csv
+import time
+import shutil
+import argparse
+import itertools
+import tempfile
+
+import numpy as np
+
+import benchmark  # sets up the environment app needs before importing it
+import app
+
+SWEEP_CSV = "hnsw_sweep.csv"
+SWEEP_PLOT = "hnsw_sweep.png"
+
+
+def unit_rows(vectors):
+    matrix = np.asarray(vectors, dtype=np.float32)
+    return matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+
+
+# Exact cosine top k by brute force, the reference HNSW recall is measured against
+def exact_neighbours(ids, embeddings, queries, k):
+    similarities = unit_rows(queries) @ unit_rows(embeddings).T
+    return [[ids[i] for i in np.argsort(-row)[:k]] for row in similarities]
+
+
+# Chunks of the PDFs, padded with seeded random vectors so the index is big
+# enough for the HNSW parameters to matter (Chroma searches small collections
+# by brute force)
+def load_corpus(pad, bedrock):
+    base = tempfile.mkdtemp(prefix="rag_sweep_base_")
+    try:
+        if bedrock:
+            app.open_embed_cache()
+        else:
+            app.use_local_embedder()
+        app.open_store(base, "chroma")
+        app.ingest_pdfs()
+        data = app.collection.get(include=["documents", "metadatas", "embeddings"])
+    finally:
+        shutil.rmtree(base, ignore_errors=True)
+
+    ids, documents, metadatas = data["ids"], data["documents"], data["metadatas"]
+    embeddings = np.asarray(data["embeddings"], dtype=np.float32)
+    if pad:
+        noise = np.random.default_rng(0).normal(size=(pad, embeddings.shape[1])).astype(np.float32)
+        ids = ids + [f"pad-{i}" for i in range(pad)]
+        documents = documents + [""] * pad
+        metadatas = metadatas + [{"source": "padding"}] * pad
+        embeddings = np.vstack([embeddings, unit_rows(noise)])
+    return ids, documents, metadatas, embeddings
+
+
+# Every grid point gets a freshly built collection: Chroma only picks up a
+# changed search_ef when the index is reloaded
+def sweep(corpus, queries, k, grid, repeat):
+    ids, documents, metadatas, embeddings = corpus
+    truth = exact_neighbours(ids, embeddings, queries, k)
+    rows = []
+    for m, construction_ef, search_ef in itertools.product(grid["m"], grid["construction_ef"], grid["search_ef"]):
+        store = tempfile.mkdtemp(prefix="rag_sweep_")
+        try:
+            app.HNSW_M, app.HNSW_CONSTRUCTION_EF, app.HNSW_SEARCH_EF = m, construction_ef, search_ef
+            app.open_store(store, "chroma")
+            start = time.perf_counter()
+            app.add_in_batches(ids, documents, embeddings.tolist(), metadatas)
+            build_s = time.perf_counter() - start
+
+            latencies = []
+            found = 0
+            for query, expected in zip(queries, truth):
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    result = app.collection.query(query_embeddings=[query.tolist()], n_results=k, include=[])
+                    latencies.append((time.perf_counter() - start) * 1000)
+                found += len(set(result["ids"][0]) & set(expected))
+            latencies.sort()
+            rows.append({
+                "m": m,
+                "construction_ef": construction_ef,
+                "search_ef": search_ef,
+                "build_s": round(build_s, 3),
+                "index_bytes": benchmark.dir_size(store),
+                f"recall@{k}": round(found / (k * len(queries)), 4),
+                **{f"p{p}_ms": round(benchmark.percentile(latencies, p), 3) for p in (50, 95, 99)},
+            })
+            print(", ".join(f"{key}={value}" for key, value in rows[-1].items()))
+        finally:
+            shutil.rmtree(store, ignore_errors=True)
+    return rows
+
+
+def save_csv(rows, path):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+# Recall against p50 latency (one line per index build) and against index size
+def save_plot(rows, k, path):
+    try:
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print("matplotlib is not installed; skipping the plot")
+        return False
+
+    recall = f"recall@{k}"
+    fig, (by_latency, by_size) = plt.subplots(1, 2, figsize=(12, 5))
+    builds = sorted({(row["m"], row["construction_ef"]) for row in rows})
+    for m, construction_ef in builds:
+        points = [row for row in rows if (row["m"], row["construction_ef"]) == (m, construction_ef)]
+        label = f"M={m}, ef_c={construction_ef}"
+        by_latency.plot([p["p50_ms"] for p in points], [p[recall] for p in points], marker="o", label=label)
+        for p in points:
+            by_latency.annotate(str(p["search_ef"]), (p["p50_ms"], p[recall]), fontsize=7)
+        by_size.scatter([p["index_bytes"] / 1e6 for p in points], [p[recall] for p in points], label=label)
+    by_latency.set(xlabel="p50 query latency (ms)", ylabel=recall, title="Recall vs latency (labels: search_ef)")
+    by_size.set(xlabel="index size (MB)", ylabel=recall, title="Recall vs index size")
+    by_latency.legend(fontsize=7)
+    fig.tight_layout()
+    fig.savefig(path, dpi=120)
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep HNSW parameters and measure recall, latency and index size")
+    parser.add_argument("--m", type=int, nargs="+", default=[8, 16, 32])
+    parser.add_argument("--construction-ef", type=int, nargs="+", default=[50, 100, 200])
+    parser.add_argument("--search-ef", type=int, nargs="+", default=[10, 50, 100, 200])
+    parser.add_argument("--k", type=int, default=app.CANDIDATES, help="Recall is measured on the dense top k")
+    parser.add_argument("--pad", type=int, default=20000, help="Random vectors added to enlarge the index")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per question")
+    parser.add_argument("--golden", default=benchmark.GOLDEN_PATH)
+    parser.add_argument("--bedrock", action="store_true", help="Embed with Titan instead of the local embedder")
+    parser.add_argument("--csv", default=SWEEP_CSV)
+    parser.add_argument("--plot", default=SWEEP_PLOT)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.pad, args.bedrock)
+    queries = unit_rows([app.embed(item["question"]) for item in benchmark.load_golden(args.golden)])
+    grid = {"m": args.m, "construction_ef": args.construction_ef, "search_ef": sorted(args.search_ef)}
+    print(f"Sweeping {len(corpus[0])} vectors, {len(queries)} queries")
+    rows = sweep(corpus, queries, args.k, grid, args.repeat)
+
+    save_csv(rows, args.csv)
+    print(f"Wrote {args.csv}")
+    if save_plot(rows, args.k, args.plot):
+        print(f"Wrote {args.plot}")
+
+
+if __name__ == "__main__":
+    main()
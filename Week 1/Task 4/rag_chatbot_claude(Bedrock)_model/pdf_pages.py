@@ -0,0 +1,13 @@
+from pypdf import PdfReader
+
+# Runs in the extraction process pool, so this module must stay free of
+# import-time setup: worker processes import it (and not app.py's clients)
+
+
+def page_count(path):
+    return len(PdfReader(path).pages)
+
+
+def extract_pages(path, start, stop):
+    reader = PdfReader(path)
+    return [(n + 1, reader.pages[n].extract_text() or "") for n in range(start, stop)]
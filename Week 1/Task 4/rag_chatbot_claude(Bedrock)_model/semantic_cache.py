@@ -0,0 +1,78 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+# In-memory semantic cache for whole answers. A new query reuses the context
+# and answer of a past query when their embeddings have a cosine similarity of
+# at least `threshold`. Entries are evicted least recently used first, and the
+# whole cache is dropped when the collection version changes.
+class SemanticCache:
+    def __init__(self, threshold, max_entries):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.version = None
+        self.next_key = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _unit(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _check_version(self, version):
+        if version != self.version:
+            self.entries.clear()
+            self.version = version
+
+    # Returns (entry, similarity) for the closest cached query above the
+    # threshold, or (None, best similarity)
+    def lookup(self, embedding, version):
+        query = self._unit(embedding)
+        with self.lock:
+            self._check_version(version)
+            if not self.entries:
+                self.misses += 1
+                return None, 0.0
+            keys = list(self.entries)
+            matrix = np.stack([self.entries[key]["embedding"] for key in keys])
+            similarities = matrix @ query
+            best = int(np.argmax(similarities))
+            similarity = float(similarities[best])
+            if similarity < self.threshold:
+                self.misses += 1
+                return None, similarity
+            self.hits += 1
+            self.entries.move_to_end(keys[best])
+            return self.entries[keys[best]], similarity
+
+    def store(self, embedding, question, context, answer, version):
+        with self.lock:
+            self._check_version(version)
+            self.entries[self.next_key] = {
+                "embedding": self._unit(embedding),
+                "question": question,
+                "context": context,
+                "answer": answer,
+            }
+            self.next_key += 1
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
@@ -0,0 +1,112 @@
+import json
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+
+import app
+
+# Requests answered at once; each one holds an executor thread while it embeds,
+# retrieves and waits on Bedrock, so this also bounds concurrent Bedrock calls
+MAX_CONCURRENT_REQUESTS = 16
+
+# Streamed answers are sent as newline-delimited JSON
+NDJSON = "application/x-ndjson"
+
+
+# Blocking work (Chroma, SQLite, Bedrock) runs in a shared thread pool, at most
+# MAX_CONCURRENT_REQUESTS at a time
+async def run_blocking(request, func, *args):
+    async with request.app["slots"]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(request.app["executor"], func, *args)
+
+
+async def ask(request):
+    try:
+        body = await request.json()
+        question = body["question"].strip()
+    except (ValueError, KeyError, TypeError, AttributeError):
+        raise web.HTTPBadRequest(text='Expected a JSON body like {"question": "..."}')
+    if not question:
+        raise web.HTTPBadRequest(text="Question is empty")
+
+    if not body.get("stream", False):
+        result = await run_blocking(request, app.answer, question)
+        return web.json_response({"answer": result["answer"], "cached": result["cached"],
+                                  "similarity": result.get("similarity")})
+
+    # The worker thread hands text deltas to the event loop through a queue;
+    # None marks the end of the answer
+    loop = asyncio.get_running_loop()
+    deltas = asyncio.Queue()
+
+    def on_text(text):
+        loop.call_soon_threadsafe(deltas.put_nowait, text)
+
+    async def produce():
+        try:
+            return await run_blocking(request, app.answer, question, on_text)
+        finally:
+            loop.call_soon_threadsafe(deltas.put_nowait, None)
+
+    task = asyncio.ensure_future(produce())
+    response = web.StreamResponse(headers={"Content-Type": NDJSON})
+    await response.prepare(request)
+    while (text := await deltas.get()) is not None:
+        await response.write(json.dumps({"text": text}).encode("utf-8") + b"\n")
+
+    try:
+        result = await task
+        final = {"done": True, "cached": result["cached"], "similarity": result.get("similarity")}
+    except Exception as e:
+        final = {"done": True, "error": str(e)}
+    await response.write(json.dumps(final).encode("utf-8") + b"\n")
+    await response.write_eof()
+    return response
+
+
+async def ingest(request):
+    lock = request.app["ingest_lock"]
+    if lock.locked():
+        raise web.HTTPConflict(text="Ingestion is already running")
+    async with lock:
+        await run_blocking(request, app.ingest_pdfs)
+    return web.json_response({"chunks": app.collection.count()})
+
+
+async def stats(request):
+    return web.json_response({
+        "chunks": app.collection.count(),
+        "embedding_cache": app.embed_cache.stats() if app.embed_cache is not None else None,
+        "semantic_cache": app.answer_cache.stats(),
+    })
+
+
+def create_app():
+    app.open_store(app.default_store_dir())
+    app.open_embed_cache()
+    server = web.Application()
+    server["executor"] = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS)
+    server["slots"] = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    server["ingest_lock"] = asyncio.Lock()
+
+    async def shutdown(server):
+        server["executor"].shutdown(wait=False)
+
+    server.on_cleanup.append(shutdown)
+    server.add_routes([
+        web.post("/ask", ask),
+        web.post("/ingest", ingest),
+        web.get("/stats", stats),
+    ])
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Gold Loan RAG chatbot HTTP service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    args = parser.parse_args()
+    web.run_app(create_app(), host=args.host, port=args.port)
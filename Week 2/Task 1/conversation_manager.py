@@ -0,0 +1,115 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Rough local token count (~4 characters per token for English text)
+def estimate_tokens(text):
+    return len(text) // 4 + 1
+
+
+def text_message(role, text):
+    return {"role": role, "content": [{"type": "text", "text": text}]}
+
+
+# Keeps the last `max_turns` turns verbatim, within `token_budget` tokens, and
+# folds older turns into a rolling summary. When the window overflows it is cut
+# back to `keep_turns` at once, so the verbatim prefix (and any prompt cache
+# built on it) changes only every few turns. `summarize(previous_summary, turns)`
+# is called on a background thread, so it never delays a reply; turns waiting
+# to be folded are still sent verbatim until the new summary is ready. Many
+# conversations can share one `executor` for their summaries.
+class ConversationManager:
+    def __init__(self, summarize, max_turns=6, token_budget=1500, keep_turns=None, executor=None):
+        self.summarize = summarize
+        self.max_turns = max_turns
+        self.token_budget = token_budget
+        self.keep_turns = max_turns if keep_turns is None else keep_turns
+        self.turns = []      # (user, assistant) pairs kept verbatim
+        self.pending = []    # pairs evicted from the window, not yet summarized
+        self.summary = ""
+        self.history_tokens = 0  # every turn so far, i.e. what re-sending it all would cost
+        self.lock = threading.Lock()
+        self.fold_lock = threading.Lock()
+        self.owns_summarizer = executor is None
+        self.summarizer = executor or ThreadPoolExecutor(max_workers=1)
+
+    @staticmethod
+    def _tokens(turns):
+        return sum(estimate_tokens(user) + estimate_tokens(assistant) for user, assistant in turns)
+
+    # Summary, messages to send for the new user input, and token counts
+    # before and after compaction
+    def context(self, user_text):
+        with self.lock:
+            verbatim = self.pending + self.turns
+            summary = self.summary
+            history_tokens = self.history_tokens
+        messages = []
+        for user, assistant in verbatim:
+            messages += [text_message("user", user), text_message("assistant", assistant)]
+        messages.append(text_message("user", user_text))
+        new_tokens = estimate_tokens(user_text)
+        return summary, messages, {
+            "before": history_tokens + new_tokens,
+            "after": (estimate_tokens(summary) if summary else 0) + self._tokens(verbatim) + new_tokens,
+            "summary": estimate_tokens(summary) if summary else 0,
+            "verbatim_turns": len(verbatim),
+        }
+
+    def add_turn(self, user_text, assistant_text):
+        with self.lock:
+            self.turns.append((user_text, assistant_text))
+            self.history_tokens += self._tokens(self.turns[-1:])
+            evicted = 0
+            if len(self.turns) > self.max_turns or self._tokens(self.turns) > self.token_budget:
+                while len(self.turns) > 1 and (len(self.turns) > self.keep_turns
+                                               or self._tokens(self.turns) > self.token_budget):
+                    self.pending.append(self.turns.pop(0))
+                    evicted += 1
+        if evicted:
+            self.summarizer.submit(self._fold)
+
+    # Runs on a summarizer thread; folds of one conversation are serialized, so
+    # pending turns are always summarized in order
+    def _fold(self):
+        with self.fold_lock:
+            self._fold_pending()
+
+    def _fold_pending(self):
+        with self.lock:
+            batch = list(self.pending)
+            previous = self.summary
+        if not batch:
+            return
+        try:
+            summary = self.summarize(previous, batch)
+        except Exception as e:
+            # The turns stay pending (and verbatim) and are retried next time
+            print(f"\n(Summary update failed: {e})")
+            return
+        with self.lock:
+            self.summary = summary
+            del self.pending[:len(batch)]
+
+    # Plain data for saving the conversation (e.g. to disk) and restoring it
+    def dump(self):
+        with self.lock:
+            return {
+                "turns": [list(turn) for turn in self.turns],
+                "pending": [list(turn) for turn in self.pending],
+                "summary": self.summary,
+                "history_tokens": self.history_tokens,
+            }
+
+    def load(self, state):
+        with self.lock:
+            self.turns = [tuple(turn) for turn in state["turns"]]
+            self.pending = [tuple(turn) for turn in state["pending"]]
+            self.summary = state["summary"]
+            self.history_tokens = state["history_tokens"]
+        if self.pending:
+            self.summarizer.submit(self._fold)
+
+    def close(self):
+        if self.owns_summarizer:
+            self.summarizer.shutdown(wait=False)
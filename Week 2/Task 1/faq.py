@@ -0,0 +1,194 @@
+import re
+import time
+import threading
+
+# Optional: a small local sentence embedding model for paraphrases the keywords
+# miss. Without it only strong keyword matches are answered locally.
+FAQ_EMBED_MODEL = "all-MiniLM-L6-v2"
+EMBED_THRESHOLD = 0.80        # similarity to an example question that is enough on its own
+KEYWORD_EMBED_THRESHOLD = 0.50  # similarity needed as well when a strong phrase matched
+
+# A strong phrase alone is not enough: most of the message's content words must
+# also appear in one of the intent's example questions, so a message that only
+# mentions "refund policy" in passing ("I don't want a refund policy
+# explanation, ...") is not answered with it
+KEYWORD_OVERLAP_THRESHOLD = 0.6
+STOPWORDS = set("""
+a an the i me my we our you your it its is are was be been am do does did can could would should will
+to of for on in at by with from and or if so how what what's when where which who why please there
+this that any some about get
+""".split())
+
+# Longer messages are usually specific cases rather than policy questions
+MAX_WORDS = 25
+
+# Messages with account specifics or a dispute always go to the model
+SPECIFICS = re.compile(
+    r"\b(?:inv(?:oice)?|txn|transaction|order|receipt)\s*(?:no\.?|number|id|#)?\s*[:#-]?\s*[a-z]*\d{3,}"
+    r"|(?:rs\.?|inr|usd|\$|₹|€|£)\s*\d|\d+(?:\.\d+)?\s*(?:rs|inr|usd|dollars|rupees)\b"
+    r"|\b\d{1,2}[/-]\d{1,2}[/-]\d{2,4}\b"
+    r"|\b(?:charged twice|double charged|twice|wrong|incorrect|dispute|fraud|unauthori[sz]ed|why was i)\b",
+    re.IGNORECASE,
+)
+
+# Later in a conversation, messages that refer back to it ("for it", "that
+# charge", "again") are about the customer's case, not general policy
+REFERS_BACK = re.compile(
+    r"\b(?:it|that|this|them|those|these|same|above|earlier|previous(?:ly)?|again|mentioned)\b", re.IGNORECASE
+)
+
+# Curated answers, owned by the billing team. "phrases" are strong cues for the
+# intent, "examples" are typical wordings used by the embedding matcher.
+FAQ = [
+    {
+        "intent": "refund_policy",
+        "phrases": ["refund policy", "get a refund", "request a refund", "how do refunds work",
+                    "money back", "refund process"],
+        "examples": ["What is your refund policy?", "How do I get a refund?", "Can I get my money back?",
+                     "How long does a refund take?"],
+        "answer": (
+            "Refunds for duplicate or incorrect charges are returned to the original payment method once "
+            "our billing team has verified the charge. To start a refund, please reply with your invoice "
+            "number, the charge date and the amount, and we will take it from there."
+        ),
+    },
+    {
+        "intent": "late_fee",
+        "phrases": ["late fee", "late fees", "late payment fee", "late charge", "overdue fee",
+                    "penalty for late payment"],
+        "examples": ["How do late fees work?", "What happens if I pay late?", "Is there a late payment fee?"],
+        "answer": (
+            "A late fee may be added when an invoice is not paid by its due date; the exact amount and any "
+            "grace period are shown on your invoice and in your plan's billing terms. If you believe a late "
+            "fee was applied by mistake, please share the invoice number and payment date so we can review it."
+        ),
+    },
+    {
+        "intent": "invoice_copy",
+        "phrases": ["copy of my invoice", "copy of the invoice", "invoice copy", "download my invoice",
+                    "download invoice", "resend invoice", "resend my invoice", "past invoices", "get my invoice"],
+        "examples": ["Can I get a copy of my invoice?", "Where can I download my invoices?",
+                     "Please resend my last invoice."],
+        "answer": (
+            "You can download all of your invoices from the Billing section of your account settings. "
+            "If you need a copy emailed to you instead, please tell us the invoice month or number and the "
+            "email address to send it to."
+        ),
+    },
+    {
+        "intent": "plan_change",
+        "phrases": ["change my plan", "change plan", "upgrade my plan", "downgrade my plan", "switch plan",
+                    "switch my plan", "upgrade plan", "downgrade plan", "change subscription"],
+        "examples": ["How do I upgrade my plan?", "Can I downgrade my subscription?",
+                     "I want to switch to a different plan."],
+        "answer": (
+            "You can upgrade or downgrade your plan from the Billing section of your account settings. "
+            "Changes are reflected on your next invoice, including any prorated amount. Let us know which "
+            "plan you would like to move to if you need help with the change."
+        ),
+    },
+]
+
+
+def normalize(text):
+    return " ".join(re.findall(r"[a-z0-9']+", text.lower()))
+
+
+def content_words(text):
+    return {word for word in normalize(text).split() if word not in STOPWORDS}
+
+
+# Share of the message's content words found in the closest example question
+def example_overlap(words, examples):
+    if not words:
+        return 0.0
+    return max(len(words & content_words(example)) / len(words) for example in examples)
+
+
+# Local intent matcher in front of the model. Counts lookups, hits per intent
+# and the model latency saved, estimated from the average latency of the
+# turns that did go to the model.
+class FaqMatcher:
+    def __init__(self, entries=FAQ, use_embeddings=True):
+        self.entries = entries
+        self.lock = threading.Lock()
+        self.counters = {"lookups": 0, "hits": 0, "model_calls": 0, "model_seconds": 0.0, "saved_seconds": 0.0}
+        self.intent_hits = {entry["intent"]: 0 for entry in entries}
+
+        self.encoder = None
+        if use_embeddings:
+            try:
+                from sentence_transformers import SentenceTransformer
+                self.encoder = SentenceTransformer(FAQ_EMBED_MODEL)
+                self.examples = [self.encoder.encode(entry["examples"], normalize_embeddings=True)
+                                 for entry in entries]
+            except Exception as e:
+                # Not installed, or the model cannot be downloaded (e.g. offline)
+                self.encoder = None
+                print(f"(FAQ embedding model unavailable, matching uses keywords only: {e})")
+
+    def _similarities(self, text):
+        if self.encoder is None:
+            return [0.0] * len(self.entries)
+        query = self.encoder.encode([text], normalize_embeddings=True)[0]
+        return [float((examples @ query).max()) for examples in self.examples]
+
+    # Returns (entry, confidence) for a confident match, or (None, 0.0).
+    # `history` holds the earlier messages of the conversation (and its
+    # summary); once the customer has described their own case, or the message
+    # refers back to it, the model answers instead.
+    def match(self, text, history=()):
+        with self.lock:
+            self.counters["lookups"] += 1
+        if len(text.split()) > MAX_WORDS or SPECIFICS.search(text):
+            return None, 0.0
+        if history and (REFERS_BACK.search(text) or any(SPECIFICS.search(earlier) for earlier in history)):
+            return None, 0.0
+
+        normalized = normalize(text)
+        words = content_words(text)
+        best, confidence = None, 0.0
+        for entry, similarity in zip(self.entries, self._similarities(text)):
+            phrase = any(normalize(p) in normalized for p in entry["phrases"])
+            overlap = example_overlap(words, entry["examples"])
+            if phrase and overlap >= KEYWORD_OVERLAP_THRESHOLD and \
+                    (self.encoder is None or similarity >= KEYWORD_EMBED_THRESHOLD):
+                score = overlap if self.encoder is None else similarity
+            elif similarity >= EMBED_THRESHOLD:
+                score = similarity
+            else:
+                continue
+            if score > confidence:
+                best, confidence = entry, score
+        return best, confidence
+
+    # Answers locally when confident; returns (answer, intent) or (None, None)
+    def answer(self, text, history=()):
+        start = time.perf_counter()
+        entry, _ = self.match(text, history)
+        if entry is None:
+            return None, None
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.counters["hits"] += 1
+            self.intent_hits[entry["intent"]] += 1
+            if self.counters["model_calls"]:
+                average = self.counters["model_seconds"] / self.counters["model_calls"]
+                self.counters["saved_seconds"] += max(0.0, average - elapsed)
+        return entry["answer"], entry["intent"]
+
+    def record_model_call(self, seconds):
+        with self.lock:
+            self.counters["model_calls"] += 1
+            self.counters["model_seconds"] += seconds
+
+    def stats(self):
+        with self.lock:
+            lookups = self.counters["lookups"]
+            return {
+                "lookups": lookups,
+                "hits": self.counters["hits"],
+                "hit_rate": round(self.counters["hits"] / lookups, 3) if lookups else 0.0,
+                "saved_seconds": round(self.counters["saved_seconds"], 2),
+                "intent_hits": dict(self.intent_hits),
+            }
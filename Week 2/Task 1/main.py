@@ -1,13 +1,73 @@
 import boto3
 import json
+import time
+import threading
+from botocore.config import Config
+from conversation_manager import ConversationManager, estimate_tokens
+from faq import FaqMatcher
+from query_router import route_query
 
 # ---------------- BEDROCK CLIENT ---------------- #
 
+# Connections shared by all threads calling Bedrock (the server runs many
+# sessions at once)
+MAX_POOL_CONNECTIONS = 16
+
 bedrock = boto3.client(
     service_name="bedrock-runtime",
-    region_name="us-east-1"
+    region_name="us-east-1",
+    config=Config(max_pool_connections=MAX_POOL_CONNECTIONS)
 )
 
+# Chat turns and background summaries together make at most
+# MAX_POOL_CONNECTIONS Bedrock calls at once; further calls wait for a slot
+bedrock_slots = threading.BoundedSemaphore(MAX_POOL_CONNECTIONS)
+
+
+def invoke(model_id, body):
+    with bedrock_slots:
+        response = bedrock.invoke_model(modelId=model_id, body=json.dumps(body))
+        return json.loads(response["body"].read())
+
+# Claude 3.7 Sonnet (cross-region inference profile) supports prompt caching;
+# the original Claude 3 Sonnet does not
+MODEL_ID = "us.anthropic.claude-3-7-sonnet-20250219-v1:0"
+
+# ---------------- CONVERSATION WINDOW ---------------- #
+
+# Only the last few turns are re-sent verbatim (within a token budget); older
+# turns are folded into a rolling summary by a cheaper model in the background.
+# The window is cut back to KEEP_TURNS at once, so the cached conversation
+# prefix stays valid for several turns between compactions.
+MAX_TURNS = 6
+KEEP_TURNS = 3
+HISTORY_TOKEN_BUDGET = 1500
+SUMMARY_MODEL_ID = "anthropic.claude-3-haiku-20240307-v1:0"
+SUMMARY_MAX_TOKENS = 300
+
+SUMMARY_PROMPT = """
+You maintain a running summary of a billing support conversation.
+Update the summary with the new turns below. Keep every detail needed to continue
+the conversation: invoice numbers, dates, amounts, transaction IDs, plan names,
+what the customer asked for and what the assistant promised. Be brief and factual.
+Reply with the updated summary only.
+"""
+
+
+def summarize(previous_summary, turns):
+    transcript = "\n".join(f"Customer: {user}\nAssistant: {assistant}" for user, assistant in turns)
+    result = invoke(SUMMARY_MODEL_ID, {
+        "anthropic_version": "bedrock-2023-05-31",
+        "system": SUMMARY_PROMPT,
+        "messages": [{
+            "role": "user",
+            "content": f"Current summary:\n{previous_summary or '(none)'}\n\nNew turns:\n{transcript}"
+        }],
+        "max_tokens": SUMMARY_MAX_TOKENS,
+        "temperature": 0
+    })
+    return result["content"][0]["text"].strip()
+
 # ---------------- PROMPTS ---------------- #
 
 # 1. WITHOUT Chain-of-Thought
@@ -42,70 +102,158 @@ Guidelines:
 - Provide clear next steps when applicable
 """
 
-# ---------------- MODE SELECTION ---------------- #
+MODES = {"standard": STANDARD_PROMPT, "cot": COT_PROMPT}
+MAX_TOKENS = 500
 
-print("Select Billing Assistant Mode:")
-print("1. Standard Billing Assistant (Without Chain-of-Thought)")
-print("2. Advanced Billing Assistant (With Hidden Chain-of-Thought)")
+# "auto" picks STANDARD or COT (and the reply budget) per message from a local
+# complexity score, so greetings and simple questions skip the longer prompt
+MODE_CHOICES = [*MODES, "auto"]
 
-choice = input("Enter 1 or 2: ").strip()
 
-if choice == "2":
-    system_prompt = COT_PROMPT
-    print("\nRunning in ADVANCED mode (Hidden Chain-of-Thought)\n")
-else:
-    system_prompt = STANDARD_PROMPT
-    print("\nRunning in STANDARD mode (No Chain-of-Thought)\n")
+# Once auto mode has picked COT the conversation stays on the COT prompt
+# (AUTO_COT): switching the system prompt back and forth would invalidate the
+# cached conversation prefix on every switch. The reply budget does not affect
+# the cache, so it is still chosen per message.
+AUTO_COT = "auto-cot"
 
-# ---------------- CHAT LOOP ---------------- #
 
-conversation = []  # ONLY user + assistant messages
+def resolve_mode(mode, user_input):
+    if mode == "auto":
+        return route_query(user_input)
+    if mode == AUTO_COT:
+        route = route_query(user_input)
+        return dict(route, mode="cot", reasons=route["reasons"] + ["cot kept for session"])
+    return {"mode": mode, "max_tokens": MAX_TOKENS}
 
-print("Billing Support Chatbot (type 'exit' to quit)\n")
 
-while True:
-    user_input = input("User: ")
+def next_mode(mode, route):
+    return AUTO_COT if mode == "auto" and route["mode"] == "cot" else mode
 
-    if user_input.lower() == "exit":
-        print("\nAssistant: Thank you for contacting billing support. Have a great day!")
-        break
+# ---------------- PROMPT CACHING ---------------- #
 
-    # Append user message
-    conversation.append({
-        "role": "user",
-        "content": [
-            {
-                "type": "text",
-                "text": user_input
-            }
-        ]
-    })
+# Cache checkpoints: one after the static system prompt and one on the newest
+# message, so the next turn reads everything up to it from the cache. The
+# rolling summary comes after the system checkpoint so updating it does not
+# invalidate the cached system prompt. Prefixes below the model's minimum
+# cacheable length (1024 tokens for 3.7 Sonnet) are simply not cached.
+CACHE_POINT = {"type": "ephemeral"}
 
-    # Invoke Claude 3
-    response = bedrock.invoke_model(
-        modelId="anthropic.claude-3-sonnet-20240229-v1:0",
-        body=json.dumps({
-            "anthropic_version": "bedrock-2023-05-31",
-            "system": system_prompt,
-            "messages": conversation,
-            "max_tokens": 500,
-            "temperature": 0.2
-        })
-    )
-
-    # Parse response
-    result = json.loads(response["body"].read())
-    assistant_reply = result["content"][0]["text"]
 
-    # Append assistant message
-    conversation.append({
-        "role": "assistant",
-        "content": [
-            {
-                "type": "text",
-                "text": assistant_reply
-            }
-        ]
+def cached_request(system_prompt, summary, messages):
+    system = [{"type": "text", "text": system_prompt, "cache_control": CACHE_POINT}]
+    if summary:
+        system.append({"type": "text", "text": f"Summary of the conversation so far:\n{summary}"})
+    last = messages[-1]
+    messages = messages[:-1] + [{
+        "role": last["role"],
+        "content": last["content"][:-1] + [dict(last["content"][-1], cache_control=CACHE_POINT)]
+    }]
+    return system, messages
+
+
+def format_cache_usage(usage):
+    read = usage.get("cache_read_input_tokens", 0)
+    written = usage.get("cache_creation_input_tokens", 0)
+    uncached = usage.get("input_tokens", 0)
+    total = read + written + uncached
+    share = f"{read / total:.0%}" if total else "0%"
+    return f"cache read {read}, cache write {written}, uncached {uncached} ({share} of prompt from cache)"
+
+# ---------------- FAQ FAST PATH ---------------- #
+
+# Common policy questions (refunds, late fees, invoice copies, plan changes) are
+# answered from a curated table without calling the model
+faq = FaqMatcher()
+
+# ---------------- CHAT TURN ---------------- #
+
+# One turn of a conversation: recent turns verbatim plus the summary of
+# everything older, with cache checkpoints. Returns the reply, the model's
+# usage, the token counts before and after compaction, and the prompt mode and
+# reply budget used.
+def chat_turn(memory, mode, user_input):
+    summary, messages, tokens = memory.context(user_input)
+
+    earlier = [message["content"][0]["text"] for message in messages[:-1] if message["role"] == "user"]
+    faq_reply, intent = faq.answer(user_input, earlier + ([summary] if summary else []))
+    if faq_reply is not None:
+        memory.add_turn(user_input, faq_reply)
+        return faq_reply, {"faq_intent": intent}, tokens, {"mode": "faq"}
+
+    route = resolve_mode(mode, user_input)
+    system, messages = cached_request(MODES[route["mode"]], summary, messages)
+
+    # Invoke Claude
+    start = time.perf_counter()
+    result = invoke(MODEL_ID, {
+        "anthropic_version": "bedrock-2023-05-31",
+        "system": system,
+        "messages": messages,
+        "max_tokens": route["max_tokens"],
+        "temperature": 0.2
     })
+    assistant_reply = result["content"][0]["text"]
+    faq.record_model_call(time.perf_counter() - start)
+
+    memory.add_turn(user_input, assistant_reply)
+    return assistant_reply, result.get("usage", {}), tokens, route
+
+
+def format_turn_log(tokens, usage, route):
+    if "faq_intent" in usage:
+        return f"[faq] answered locally ({usage['faq_intent']}), no model call"
+    system_prompt = MODES[route["mode"]]
+    mode = f"[mode] {route['mode']}, max_tokens {route['max_tokens']}"
+    if "score" in route:
+        mode += f" (auto: score {route['score']}, {', '.join(route['reasons']) or 'simple'})"
+    return (f"{mode}\n[tokens] history ~{tokens['before']} -> ~{tokens['after']} after compaction "
+            f"(summary ~{tokens['summary']}, {tokens['verbatim_turns']} turns verbatim, "
+            f"system ~{estimate_tokens(system_prompt)}); "
+            f"model: {usage.get('input_tokens', '?')} in / {usage.get('output_tokens', '?')} out\n"
+            f"[cache] {format_cache_usage(usage)}")
+
+
+if __name__ == "__main__":
+    # ---------------- MODE SELECTION ---------------- #
+
+    print("Select Billing Assistant Mode:")
+    print("1. Standard Billing Assistant (Without Chain-of-Thought)")
+    print("2. Advanced Billing Assistant (With Hidden Chain-of-Thought)")
+    print("3. Automatic (Chooses per message)")
+
+    choice = input("Enter 1, 2 or 3: ").strip()
+
+    if choice == "2":
+        mode = "cot"
+        print("\nRunning in ADVANCED mode (Hidden Chain-of-Thought)\n")
+    elif choice == "3":
+        mode = "auto"
+        print("\nRunning in AUTO mode (Standard or Chain-of-Thought per message)\n")
+    else:
+        mode = "standard"
+        print("\nRunning in STANDARD mode (No Chain-of-Thought)\n")
+
+    # ---------------- CHAT LOOP ---------------- #
+
+    memory = ConversationManager(summarize, MAX_TURNS, HISTORY_TOKEN_BUDGET, KEEP_TURNS)
+    session_usage = {"cache_read_input_tokens": 0, "cache_creation_input_tokens": 0, "input_tokens": 0}
+
+    print("Billing Support Chatbot (type 'exit' to quit)\n")
+
+    while True:
+        user_input = input("User: ")
+
+        if user_input.lower() == "exit":
+            memory.close()
+            print(f"\n[session] {format_cache_usage(session_usage)}")
+            print(f"[faq] {faq.stats()}")
+            print("\nAssistant: Thank you for contacting billing support. Have a great day!")
+            break
+
+        assistant_reply, usage, tokens, route = chat_turn(memory, mode, user_input)
+        mode = next_mode(mode, route)
 
-    print("\nAssistant:", assistant_reply, "\n")
+        print("\nAssistant:", assistant_reply, "\n")
+        print(format_turn_log(tokens, usage, route) + "\n")
+        for key in session_usage:
+            session_usage[key] += usage.get(key, 0)
@@ -0,0 +1,75 @@
+import re
+
+# Auto mode: messages scoring at least COT_THRESHOLD get the hidden
+# chain-of-thought prompt; the rest get the standard prompt with a smaller
+# reply budget, and greetings/thanks an even smaller one
+COT_THRESHOLD = 3
+COT_MAX_TOKENS = 500
+SIMPLE_MAX_TOKENS = 300
+TRIVIAL_MAX_TOKENS = 100
+
+TRIVIAL = re.compile(
+    r"^\W*(?:hi|hello|hey|good (?:morning|afternoon|evening)|thanks?|thank you|thx|ok(?:ay)?|cool|great|"
+    r"bye|goodbye|yes|no|sure)(?:\W+(?:so much|a lot|there|again|bye|you))*\W*$",
+    re.IGNORECASE,
+)
+
+# Account details the model has to reason over, with their weight in the
+# score. A reference (invoice, transaction, ...) points at a specific case, so
+# together with a date or an amount it is enough for COT on its own.
+ENTITY_WEIGHTS = {"reference": 2, "amount": 1, "date": 1}
+ENTITIES = {
+    "reference": re.compile(r"\b(?:inv(?:oice)?|txn|transaction|order|receipt|customer|account)\s*"
+                            r"(?:no\.?|number|id|#)?\s*[:#-]?\s*[a-z]*\d{3,}", re.IGNORECASE),
+    "amount": re.compile(r"(?:rs\.?|inr|usd|\$|₹|€|£)\s*\d|\d+(?:\.\d+)?\s*(?:rs|inr|usd|dollars|rupees)\b",
+                         re.IGNORECASE),
+    "date": re.compile(r"\b\d{1,2}[/-]\d{1,2}[/-]\d{2,4}\b|\b(?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)"
+                       r"[a-z]*\.? \d{1,2}\b|\b\d{1,2} (?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)",
+                       re.IGNORECASE),
+}
+
+# Something went wrong and needs to be worked out against billing policy
+DISPUTE = re.compile(r"\b(?:charged twice|double[- ]charged|overcharged|wrong(?:ly)?|incorrect(?:ly)?|dispute|"
+                     r"fraud|unauthori[sz]ed|chargeback|not (?:received|applied|refunded|reflected)|"
+                     r"shows? (?:as )?(?:unpaid|pending|overdue)|still (?:unpaid|pending|due))\b", re.IGNORECASE)
+
+# Topics with billing rules behind them
+POLICY = re.compile(r"\b(?:refund|late fee|penalt|prorat|cancel|tax|gst|vat|credit|discount|grace period|"
+                    r"renewal|downgrade|upgrade)", re.IGNORECASE)
+
+
+# Local complexity score of a customer message, with the reasons behind it
+def score_complexity(text):
+    words = len(text.split())
+    score = 0
+    reasons = []
+    if words > 40:
+        score += 2
+        reasons.append(f"{words} words")
+    elif words > 15:
+        score += 1
+        reasons.append(f"{words} words")
+    for name, pattern in ENTITIES.items():
+        if pattern.search(text):
+            score += ENTITY_WEIGHTS[name]
+            reasons.append(name)
+    if DISPUTE.search(text):
+        score += 3
+        reasons.append("dispute")
+    if POLICY.search(text):
+        score += 1
+        reasons.append("policy")
+    if text.count("?") > 1:
+        score += 1
+        reasons.append("several questions")
+    return score, reasons
+
+
+# Picks the prompt mode and reply budget for one message
+def route_query(text):
+    if TRIVIAL.match(text):
+        return {"mode": "standard", "max_tokens": TRIVIAL_MAX_TOKENS, "score": 0, "reasons": ["trivial"]}
+    score, reasons = score_complexity(text)
+    if score >= COT_THRESHOLD:
+        return {"mode": "cot", "max_tokens": COT_MAX_TOKENS, "score": score, "reasons": reasons}
+    return {"mode": "standard", "max_tokens": SIMPLE_MAX_TOKENS, "score": score, "reasons": reasons}
@@ -0,0 +1,117 @@
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+
+import main
+from conversation_manager import ConversationManager
+from session_store import SessionStore
+
+# Threads running chat turns and background summaries. Their Bedrock calls
+# share main.bedrock_slots, so at most main.MAX_POOL_CONNECTIONS are in flight
+# at once across both pools.
+BEDROCK_WORKERS = main.MAX_POOL_CONNECTIONS
+SUMMARY_WORKERS = 4
+
+MAX_SESSIONS = 1000
+IDLE_TIMEOUT = 30 * 60
+SWEEP_INTERVAL = 60
+
+
+async def create_session(request):
+    try:
+        body = await request.json() if request.can_read_body else {}
+    except ValueError:
+        raise web.HTTPBadRequest(text="Expected a JSON object body")
+    if not isinstance(body, dict):
+        raise web.HTTPBadRequest(text="Expected a JSON object body")
+    mode = body.get("mode", "standard")
+    if mode not in main.MODE_CHOICES:
+        raise web.HTTPBadRequest(text=f"mode must be one of {main.MODE_CHOICES}")
+    session = request.app["store"].create(mode)
+    return web.json_response({"session_id": session.id, "mode": mode}, status=201)
+
+
+async def send_message(request):
+    session = request.app["store"].get(request.match_info["session_id"])
+    if session is None:
+        raise web.HTTPNotFound(text="Unknown or expired session")
+
+    # Marked busy before the first await, so a concurrent request cannot evict
+    # (and spill) the session while this one is still reading its body
+    session.active += 1
+    try:
+        try:
+            text = (await request.json())["text"].strip()
+        except (ValueError, KeyError, TypeError, AttributeError):
+            raise web.HTTPBadRequest(text='Expected a JSON body like {"text": "..."}')
+        if not text:
+            raise web.HTTPBadRequest(text="Message is empty")
+
+        loop = asyncio.get_running_loop()
+        async with session.lock:
+            reply, usage, tokens, route = await loop.run_in_executor(
+                request.app["bedrock_pool"], main.chat_turn, session.memory, session.mode, text
+            )
+            session.mode = main.next_mode(session.mode, route)
+    finally:
+        session.active -= 1
+
+    print(f"[{session.id[:8]}] " + main.format_turn_log(tokens, usage, route))
+    return web.json_response({"reply": reply, "usage": usage, "tokens": tokens, "route": route})
+
+
+async def end_session(request):
+    if not request.app["store"].delete(request.match_info["session_id"]):
+        raise web.HTTPNotFound(text="Unknown or expired session")
+    return web.json_response({"ended": True})
+
+
+async def stats(request):
+    return web.json_response({"sessions": request.app["store"].stats(), "faq": main.faq.stats()})
+
+
+async def sweep_sessions(server):
+    while True:
+        await asyncio.sleep(SWEEP_INTERVAL)
+        server["store"].expire_idle()
+
+
+def create_app(spill_dir=None):
+    server = web.Application()
+    server["bedrock_pool"] = ThreadPoolExecutor(max_workers=BEDROCK_WORKERS)
+    summaries = ThreadPoolExecutor(max_workers=SUMMARY_WORKERS)
+
+    def new_memory():
+        return ConversationManager(main.summarize, main.MAX_TURNS, main.HISTORY_TOKEN_BUDGET,
+                                   main.KEEP_TURNS, executor=summaries)
+
+    server["store"] = SessionStore(new_memory, MAX_SESSIONS, IDLE_TIMEOUT, spill_dir)
+
+    async def start(server):
+        server["sweeper"] = asyncio.ensure_future(sweep_sessions(server))
+
+    async def stop(server):
+        server["sweeper"].cancel()
+        server["bedrock_pool"].shutdown(wait=False)
+        summaries.shutdown(wait=False)
+
+    server.on_startup.append(start)
+    server.on_cleanup.append(stop)
+    server.add_routes([
+        web.post("/sessions", create_session),
+        web.post("/sessions/{session_id}/messages", send_message),
+        web.delete("/sessions/{session_id}", end_session),
+        web.get("/stats", stats),
+    ])
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Billing assistant HTTP server for many concurrent sessions")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--spill-dir", help="Keep evicted sessions here instead of dropping them")
+    args = parser.parse_args()
+    web.run_app(create_app(args.spill_dir), host=args.host, port=args.port)
@@ -0,0 +1,117 @@
+import os
+import re
+import json
+import time
+import uuid
+import asyncio
+from collections import OrderedDict
+
+SESSION_ID = re.compile(r"[0-9a-f]{32}")
+
+
+class Session:
+    def __init__(self, session_id, mode, memory):
+        self.id = session_id
+        self.mode = mode
+        self.memory = memory
+        self.last_used = time.monotonic()
+        self.lock = asyncio.Lock()  # one turn at a time per session
+        self.active = 0             # requests holding or waiting for the lock
+
+    def busy(self):
+        return self.active > 0
+
+
+# In-memory sessions in least-recently-used order. Sessions idle for longer
+# than idle_timeout, or the least recently used ones beyond max_sessions, are
+# evicted; with spill_dir they are written there as JSON and restored on their
+# next request, otherwise they are dropped. Busy sessions are never evicted.
+class SessionStore:
+    def __init__(self, create_memory, max_sessions=1000, idle_timeout=1800, spill_dir=None, spill_ttl=86400):
+        self.create_memory = create_memory
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.spill_dir = spill_dir
+        self.spill_ttl = spill_ttl
+        self.sessions = OrderedDict()
+        self.counters = {"created": 0, "evicted": 0, "spilled": 0, "restored": 0}
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+
+    def _spill_path(self, session_id):
+        return os.path.join(self.spill_dir, f"{session_id}.json")
+
+    def create(self, mode):
+        session = Session(uuid.uuid4().hex, mode, self.create_memory())
+        self.sessions[session.id] = session
+        self.counters["created"] += 1
+        self._enforce_capacity(session)
+        return session
+
+    def get(self, session_id):
+        session = self.sessions.get(session_id)
+        if session is None:
+            session = self._restore(session_id)
+            if session is None:
+                return None
+        self.sessions.move_to_end(session_id)
+        session.last_used = time.monotonic()
+        return session
+
+    def delete(self, session_id):
+        session = self.sessions.pop(session_id, None)
+        if session is not None:
+            session.memory.close()
+        if self.spill_dir and SESSION_ID.fullmatch(session_id) and os.path.exists(self._spill_path(session_id)):
+            os.remove(self._spill_path(session_id))
+            return True
+        return session is not None
+
+    def _restore(self, session_id):
+        if not self.spill_dir or not SESSION_ID.fullmatch(session_id):
+            return None
+        path = self._spill_path(session_id)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        os.remove(path)
+        session = Session(session_id, state["mode"], self.create_memory())
+        session.memory.load(state["memory"])
+        self.sessions[session_id] = session
+        self.counters["restored"] += 1
+        self._enforce_capacity(session)
+        return session
+
+    def _evict(self, session):
+        del self.sessions[session.id]
+        self.counters["evicted"] += 1
+        if self.spill_dir:
+            path = self._spill_path(session.id)
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump({"mode": session.mode, "memory": session.memory.dump()}, f)
+            os.replace(path + ".tmp", path)
+            self.counters["spilled"] += 1
+        session.memory.close()
+
+    # Evicts least recently used idle sessions, never `keep`
+    def _enforce_capacity(self, keep):
+        idle = [s for s in self.sessions.values() if not s.busy() and s is not keep]
+        for session in idle[:max(0, len(self.sessions) - self.max_sessions)]:
+            self._evict(session)
+
+    # Called periodically: evicts idle sessions and deletes old spill files
+    def expire_idle(self):
+        cutoff = time.monotonic() - self.idle_timeout
+        for session in [s for s in self.sessions.values() if s.last_used < cutoff and not s.busy()]:
+            self._evict(session)
+        if self.spill_dir:
+            oldest = time.time() - self.spill_ttl
+            for name in os.listdir(self.spill_dir):
+                path = os.path.join(self.spill_dir, name)
+                if name.endswith(".json") and os.path.getmtime(path) < oldest:
+                    os.remove(path)
+
+    def stats(self):
+        spilled = len([n for n in os.listdir(self.spill_dir) if n.endswith(".json")]) if self.spill_dir else 0
+        return {"active": len(self.sessions), "on_disk": spilled, **self.counters}